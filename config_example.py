@@ -18,7 +18,14 @@ spout_calibration           = dict( durations = [.063*i for i in [1., 1.2, 1.4,
                                     volumes = [i/25. for i in [100, 125, 150, 175]] # uL
                                   )
 stim_dur = 0.015
-ar_params                   = dict(lick_thresh=3.5, moving_magnitude=5., ports=['ai2','ai3','ai4','ai5','ai6','ai0'], portnames=['lickl','lickr','puffl','puffr','galvo','hall'], runtime_ports=[0,1,5])
+ar_params                   = dict(lick_thresh=3.5, moving_magnitude=5., ports=['ai2','ai3','ai4','ai5','ai6','ai0'], portnames=['lickl','lickr','puffl','puffr','galvo','hall'], runtime_ports=[0,1,5],
+                                   daq_sample_rate=500., read_buf_size=10, accum_size=2000, save_buffer_size=8000, # samples; save_buffer_size must be a multiple of read_buf_size (see util/bench_daq.py for choosing them)
+                                   int16=False, # acquire, buffer and save samples as int16 counts (table analog_int16, scale/offset in session params ar_scaling) rather than float64 volts
+                                   spill=False, # write samples to a binary spill file, converted into the data file between sessions, instead of through the saver (see hardware/spill.py)
+                                   features=[   dict(kind='lowpass', name='hall_lp', channel='hall', cutoff=10.), # online features, see hardware/features.py; puffl_count/puffr_count are checked against puffs given
+                                                dict(kind='speed', name='speed', channel='hall', thresh=2.5, window=1.),
+                                                dict(kind='pulses', name='puffl', channel='puffl', thresh=2., min_interval=0.005),
+                                                dict(kind='pulses', name='puffr', channel='puffr', thresh=2., min_interval=0.005)])
 stimulator_params           = dict(ports=['port0/line0','port0/line1'], duration=stim_dur)
 spout_params                = dict(ports=['port0/line2','port0/line3'], duration=reward_dur, calibration=spout_calibration)
 light_params                = dict(port='port0/line4')
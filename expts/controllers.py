@@ -1,12 +1,17 @@
 import threading, wx, time, sys, logging, Queue
 import numpy as np
 from session import Session
+from shards import merge_shards, default_shard_dir
+from history import summary_ok, build_trials_summary
+from journal import replay_journals, default_journal_dir
 from views import View, MP285View
 from subjects import Subject, list_subjects, list_rewards
 from settings import manipulations, conditions, manip_strs, default_manipulation
 from settings.param_handlers import ParamHandler
 from hardware.valve import open_valves, close_valves, give_reward, puff_check
 from hardware.mp285 import MP285, set_mp285_home, get_mp285_home
+from hardware.spill import convert_spills, default_spill_dir
+from hardware.camera_stats import describe
 from hardware import LActuator
 from util import setup_logging
 from util import TCPIP
@@ -90,10 +95,14 @@ class Controller:
 
 
         # Runtime
+        self.merge_th = None
         self.update_state(self.STATE_NULL)
         self.last_cam_frame = None
         self.n_updates = 0
 
+        # Consolidate any session shards left over from previous runs
+        self.merge_data()
+
         # Run
         #self.view.Show()
         self.app.MainLoop()
@@ -224,6 +233,30 @@ class Controller:
             self.view.imaging_box.SetValue(False)
             self.view.manip_box.SetSelection(0)
             self.view.cond_box.SetSelection(0)
+            self.merge_data(saver=self.session.saver)
+
+    def merge_data(self, saver=None):
+        # Merges session shards into the main data file in the background, once saver (if supplied) has finished writing
+        # First replays any journals left by savers that did not finish cleanly, and converts analog spill files; also builds the trials summary, if the data file predates it
+        def merge():
+            if saver is not None:
+                saver.join()
+            replay_journals(default_journal_dir(config.datafile))
+            convert_spills(default_spill_dir(config.datafile))
+            merge_shards(default_shard_dir(config.datafile), config.datafile)
+            if not summary_ok(config.datafile):
+                logging.info('Building trials summary for faster subject lookups (one-off)...')
+                build_trials_summary(config.datafile)
+            wx.CallAfter(self.view.update_sub_choices, list_rewards())
+        self.merge_th = threading.Thread(target=merge)
+        self.merge_th.start()
+    def wait_for_merge(self):
+        # To be called before anything that opens the main data file
+        if self.merge_th is None or not self.merge_th.is_alive():
+            return
+        bi = wx.BusyInfo('Merging session data into main data file...', self.view)
+        self.merge_th.join()
+        bi.Destroy()
     
     def update(self):
         if (not self.session.session_on) and self.state == self.STATE_RUNNING:
@@ -242,7 +275,8 @@ class Controller:
 
         # plots
         try:
-            self.view.set_lick_data(self.session.ar.get_accum())
+            accum,accum_ts = self.session.ar.get_accum_snapshot()
+            self.view.set_lick_data(accum, ts=accum_ts)
         except Queue.Empty:
             pass
         except:
@@ -261,6 +295,11 @@ class Controller:
         #    if cc < 0.85:
         #        self.evt_resetcam(None)
         #self.last_cam_frame = cam_frame
+
+        # video frame accounting: written/acquired while saving, dropped, skipped, ring depth, per camera
+        cam_stats = self.session.cam.get_stats()
+        if cam_stats is not None:
+            self.view.video_widg.SetValue(describe(cam_stats))
         
         # trial
         if new_trial_flag:
@@ -300,8 +339,10 @@ class Controller:
             self.mp285.saver = None
             self.session.end()
             self.update_state(self.STATE_NULL)
+            self.merge_data(saver=self.session.saver)
 
         else:
+            self.wait_for_merge()
             sel_sub = self.view.sub_box.GetSelection()
             sel_cond = self.view.cond_box.GetSelection()
             sel_manip = self.view.manip_box.GetSelection()
@@ -365,6 +406,7 @@ class Controller:
         evt.Veto()
         self.mp285_view.Hide()
     def evt_mp285_set(self, evt, detail):
+        self.wait_for_merge()
 
         pos = self.mp285.get_pos()
 
@@ -383,6 +425,7 @@ class Controller:
             set_mp285_home(pos)
             
     def evt_mp285_goto(self, evt, detail):
+        self.wait_for_merge()
 
         if detail in ['stim','lick']:
             sel_sub = self.view.sub_box.GetSelection()
@@ -478,6 +521,7 @@ class Controller:
                     self.update_state(self.STATE_KILLED_SESSION)
                     while self.state != self.STATE_RUN_COMPLETE:
                         pass
+                self.wait_for_merge()
                 if self.update_timer is not None:
                     self.update_timer.Stop()
                 self.mp285.end()
@@ -492,6 +536,7 @@ class Controller:
         dlg = wx.TextEntryDialog(self.view, message='Enter new subject name:')
         ret = dlg.ShowModal()
         if ret == wx.ID_OK:
+            self.wait_for_merge()
             self.view.add_sub(dlg.GetValue().strip().lower(), rewards=list_rewards())
         else:
             pass
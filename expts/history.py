@@ -0,0 +1,111 @@
+"""
+Per-subject trial history, looked up through where= selections on the trials table's indexed subj and session columns, and a per-session summary table (SUMMARY_KEY), rather than by loading the whole trials table.
+To build the summary table and indexes for an older data file: python -m expts.history [data_file]
+"""
+import os, sys, logging, warnings, tables
+import pandas as pd
+import numpy as np
+import config
+from util import now, now2
+from shards import unmerged_shards
+
+SUMMARY_KEY = 'summaries/trials'
+SUMMARY_COLUMNS = ['n_trials','last_level','level_start','n_rewards_l','n_rewards_r','reward_scale_l','reward_scale_r']
+
+def summary_ok(data_file=config.datafile):
+    # Whether data_file's summary table covers all of its trials (i.e. it exists, or there are no trials yet)
+    if not os.path.exists(data_file):
+        return True
+    with pd.HDFStore(data_file, mode='r') as f:
+        return ('trials' not in f) or (SUMMARY_KEY in f)
+
+def select(key, data_file=config.datafile, shard_dir=None, subj_num=None, where=None):
+    # Rows of key matching where, from data_file followed by any of subj_num's shards not yet merged into it
+    parts = []
+    for path in [data_file] + unmerged_shards(shard_dir, subj_num):
+        if not os.path.exists(path):
+            continue
+        with pd.HDFStore(path, mode='r') as f:
+            if key in f:
+                parts.append(f.select(key, where=where))
+    if len(parts) == 0:
+        return None
+    return pd.concat(parts)
+
+def last_summary(data_file=config.datafile, shard_dir=None, subj_num=None):
+    # Summary row (Series) of subj_num's most recent session, or None
+    summ = select(SUMMARY_KEY, data_file, shard_dir, subj_num, where='subj == {!r}'.format(float(subj_num)))
+    if summ is None or len(summ) == 0:
+        return None
+    return summ.sort_values('session').iloc[-1]
+
+def summarise_session(trials, sesh, subj_num, prev=None):
+    """
+    Summary row of one session's trials; prev is the subject's previous summary row, as from last_summary
+    """
+    sesh = pd.Timestamp(sesh)
+    levels = np.asarray(trials.level)
+    lev = levels[-1]
+    if np.all(levels==lev) and prev is not None and prev.last_level==lev:
+        level_start = prev.level_start # current level run began in an earlier session
+    else:
+        level_start = sesh
+
+    rewarded = np.asarray(trials.reward != False)
+    sides = np.asarray(trials.side)
+    scales = np.asarray(trials.reward_scale, dtype=float)
+    row = dict( subj = np.float64(subj_num),
+                session = sesh,
+                n_trials = len(trials),
+                last_level = float(lev),
+                level_start = pd.Timestamp(level_start),
+                n_rewards_l = int(np.sum(rewarded & (sides==0))),
+                n_rewards_r = int(np.sum(rewarded & (sides==1))),
+                reward_scale_l = float(np.sum(scales[rewarded & (sides==0)])),
+                reward_scale_r = float(np.sum(scales[rewarded & (sides==1)])),
+                ts_global = now2(),
+              )
+    return pd.DataFrame(row, index=[now()], columns=SUMMARY_COLUMNS+['session','subj','ts_global'])
+
+def append_summary(store, row):
+    store.append(SUMMARY_KEY, row, index=False, data_columns=['session','subj','ts_global'], complevel=0)
+
+def past_trials(subj_num, data_file=config.datafile, shard_dir=None, lastlevel=True):
+    """
+    Trials of subj_num, in order; lastlevel: only from the session in which the current level began
+    """
+    where = 'subj == {!r}'.format(float(subj_num))
+    if lastlevel:
+        prev = last_summary(data_file, shard_dir, subj_num)
+        if prev is not None:
+            where += ' & session >= {!r}'.format(str(prev.level_start))
+    return select('trials', data_file, shard_dir, subj_num, where=where)
+
+def index_trials(store):
+    store.create_table_index('trials', columns=['subj','session'], optlevel=6, kind='medium')
+
+def build_trials_summary(data_file=config.datafile):
+    # One-off: (re)builds the summary table from the full trials table, and indexes the trials table
+    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+    with pd.HDFStore(data_file, mode='a') as f:
+        if 'trials' not in f:
+            return 0
+        trials = f.trials
+        if SUMMARY_KEY in f:
+            f.remove(SUMMARY_KEY)
+        prevs = {}
+        rows = []
+        for sesh in pd.unique(trials.session):
+            stris = trials[trials.session==sesh]
+            for subj in pd.unique(stris.subj):
+                row = summarise_session(stris[stris.subj==subj], sesh, subj, prev=prevs.get(subj))
+                prevs[subj] = row.iloc[0]
+                rows.append(row)
+        if len(rows):
+            append_summary(f, pd.concat(rows))
+        index_trials(f)
+    return len(rows)
+
+if __name__ == '__main__':
+    data_file = sys.argv[1] if len(sys.argv) > 1 else config.datafile
+    print('Summarised {} session(s).'.format(build_trials_summary(data_file)))
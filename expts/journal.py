@@ -0,0 +1,166 @@
+"""
+Write-ahead journal for the Saver: each put/append is recorded in a per-session journal file before it reaches the HDF store, and committed once it has, so that replay can restore whatever a crash kept out of the store.
+Records are magic, payload length, crc32 and a pickled dict (header, put, append or commit); a torn last record fails its checks and is ignored.
+To replay manually: python -m expts.journal [journal_file_or_dir] [--out data_file]
+"""
+import os, sys, struct, zlib, glob, logging, warnings, argparse, tables
+import cPickle as pickle
+import pandas as pd
+import numpy as np
+import config
+
+MAGIC = 'SVJ1'
+HEADER = struct.Struct('<4sII')
+EXT = '.journal'
+
+def default_journal_dir(data_file=config.datafile):
+    return os.path.join(os.path.dirname(os.path.abspath(data_file)), 'journal')
+
+def journal_path(journal_dir, sesh_name, subj_num):
+    return os.path.join(journal_dir, '{}_{}{}'.format(sesh_name.strftime('%Y%m%d%H%M%S'), int(subj_num), EXT))
+
+class Journal(object):
+    def __init__(self, path, fsync=False, **header):
+        self.path = path
+        self.fsync = fsync # fsync after every record; without it, the journal survives a crash of the saver but not of the OS
+        self.seq = 0
+        self.pending = set() # seqs recorded but not committed
+        self.file = open(self.path, 'ab')
+        self._write(dict(kind='header', **header))
+
+    def record(self, kind, key, obj, **kwargs):
+        self.seq += 1
+        self._write(dict(kind=kind, seq=self.seq, key=key, obj=obj, **kwargs))
+        self.pending.add(self.seq)
+        return self.seq
+
+    def commit(self, seq):
+        self._write(dict(kind='commit', seq=seq))
+        self.pending.discard(seq)
+
+    def close(self, remove=False):
+        self.file.close()
+        if remove:
+            os.remove(self.path)
+
+    def _write(self, payload):
+        payload = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+        self.file.write(HEADER.pack(MAGIC, len(payload), zlib.crc32(payload) & 0xffffffff) + payload)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+def _positions(obj):
+    # (column to locate obj's rows by in its table, their values in obj): ts_global, or the index for sample-indexed tables, which have no ts_global
+    if 'ts_global' in obj:
+        return 'ts_global', obj.ts_global.values
+    return 'index', obj.index.values
+
+def read_journal(path):
+    # Returns the list of intact record payloads, in order, stopping at the first torn or corrupt record
+    records = []
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(HEADER.size)
+            if len(head) < HEADER.size:
+                break
+            magic,length,crc = HEADER.unpack(head)
+            payload = f.read(length)
+            if magic != MAGIC or len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+                logging.warning('Journal {} is torn or corrupt after {} records; ignoring the remainder.'.format(path, len(records)))
+                break
+            records.append(pickle.loads(payload))
+    return records
+
+def replay(path, out_file=None):
+    """
+    Restores into out_file (default: the file the saver was writing) whatever the journal at path holds that is missing from it
+    Returns (number of puts redone, number of rows appended)
+    """
+    records = read_journal(path)
+    if len(records) == 0 or records[0]['kind'] != 'header':
+        raise Exception('Journal {} has no header.'.format(path))
+    header = records[0]
+    if out_file is None or os.path.abspath(out_file) == header['out_file']:
+        out_file = header['out_file']
+        committed = set(r['seq'] for r in records if r['kind'] == 'commit')
+    else:
+        committed = set()
+    sesh = pd.Timestamp(header['session'])
+
+    # ts_global (or index) values of committed rows, per table, for telling which rows of uncommitted appends already reached the store
+    committed_ts = {}
+    for r in records:
+        if r['kind'] == 'append' and r['seq'] in committed:
+            committed_ts.setdefault(r['key'], []).append(_positions(r['obj'])[1])
+    committed_ts = {k:np.sort(np.concatenate(v)) for k,v in committed_ts.items()}
+
+    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+    n_puts,n_rows = 0,0
+    with pd.HDFStore(out_file, mode='a') as f:
+        # count, before writing anything, rows already present in the range of each uncommitted append
+        todo = []
+        for r in records:
+            if r['kind'] not in ['put','append'] or r['seq'] in committed:
+                continue
+            if r['kind'] == 'put':
+                todo.append((r, 0))
+                continue
+            col,ts = _positions(r['obj'])
+            lo,hi = ts.min(),ts.max()
+            present = 0
+            if r['key'] in f:
+                present = len(f.select_as_coordinates(r['key'], where='session == sesh & {0} >= lo & {0} <= hi'.format(col)))
+            cts = committed_ts.get(r['key'], np.array([]))
+            present -= np.searchsorted(cts, hi, side='right') - np.searchsorted(cts, lo, side='left')
+            if present < 0:
+                logging.warning('Table {} holds fewer committed rows than journal {} records.'.format(r['key'], path))
+            todo.append((r, int(np.clip(present, 0, len(ts)))))
+
+        for r,skip in todo:
+            if r['kind'] == 'put':
+                f.put(r['key'], r['obj'])
+                n_puts += 1
+            elif skip < len(r['obj']):
+                # an interrupted append leaves a prefix of its rows in the table
+                f.append(r['key'], r['obj'].iloc[skip:], index=False, data_columns=['session','subj','ts_global'], **r['opts'])
+                n_rows += len(r['obj']) - skip
+    return n_puts,n_rows
+
+def replay_journals(journal_dir, remove=True):
+    """
+    Replays every journal left in journal_dir (no saver may be writing there), and returns how many
+    """
+    n = 0
+    for path in sorted(glob.glob(os.path.join(journal_dir, '*'+EXT))):
+        try:
+            out_file = read_journal(path)[0]['out_file']
+            if not os.path.exists(out_file):
+                logging.warning('Store {} of journal {} no longer exists; replay it manually with --out.'.format(out_file, path))
+                continue
+            n_puts,n_rows = replay(path)
+        except:
+            logging.error('Failed to replay journal {}; it remains in place.'.format(path))
+            logging.error(sys.exc_info())
+            continue
+        logging.warning('Replayed journal {}: {} puts, {} rows restored into {}.'.format(path, n_puts, n_rows, out_file))
+        n += 1
+        if remove:
+            os.remove(path)
+    return n
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay saver journals')
+    parser.add_argument('path', nargs='?', default=default_journal_dir(config.datafile), help='journal file, or directory of journals')
+    parser.add_argument('--out', default=None, help='store to replay into, instead of the one each journal was written for')
+    parser.add_argument('--keep', action='store_true', help='keep journals after replaying them')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path) and args.out is None:
+        print('Replayed {} journal(s).'.format(replay_journals(args.path, remove=not args.keep)))
+    else:
+        paths = sorted(glob.glob(os.path.join(args.path, '*'+EXT))) if os.path.isdir(args.path) else [args.path]
+        for path in paths:
+            print('{}: {} puts, {} rows restored.'.format(path, *replay(path, args.out)))
+            if not args.keep:
+                os.remove(path)
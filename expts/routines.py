@@ -1,8 +1,64 @@
+import collections
+import multiprocessing as mp
+import numpy as np
 from util import now,now2
 
-def add_to_saver_buffer(buf, source, data, ts=None, ts2=None, columns=None):
+def add_to_saver_buffer(buf, source, data, ts=None, ts2=None, columns=None, samples=None):
+    # samples: if given, the record's rows are indexed by these sample indices, in place of timestamps (see hardware/sample_clock.py)
+    if samples is not None:
+        buf.put([source, data, samples, None, columns])
+        return
     if ts is None:
         ts = now()
     if ts2 is None:
         ts2 = now2()
-    buf.put([source, data, ts, ts2, columns])
\ No newline at end of file
+    buf.put([source, data, ts, ts2, columns])
+
+# Stands in for the data of a saver record whose samples live in a SharedRing slot
+RingSlot = collections.namedtuple('RingSlot', ['idx', 'n', 'sampled'])
+
+class SharedRing(object):
+    """
+    Shared-memory ring of (n_channels x n_samples) blocks, each with its (ts,ts2) timestamps or its sample indices, so that large blocks reach the saver without being pickled
+    Single producer, single consumer; create it before starting either process
+    """
+    def __init__(self, n_channels, n_samples, n_slots=4, dtype=np.float64):
+        self.n_channels = n_channels
+        self.n_samples = n_samples
+        self.n_slots = n_slots
+        self.dtype = np.dtype(dtype)
+        self._data = mp.RawArray(self.dtype.char, n_slots*n_channels*n_samples)
+        self._ts = mp.RawArray('d', n_slots*2*n_samples)
+        self._free = mp.Semaphore(n_slots)
+        self._next = 0 # producer side only
+
+    def _views(self):
+        data = np.frombuffer(self._data, dtype=self.dtype).reshape([self.n_slots, self.n_channels, self.n_samples])
+        ts = np.frombuffer(self._ts).reshape([self.n_slots, 2, self.n_samples])
+        return data,ts
+
+    def put(self, data, ts, ts2, timeout=0.):
+        # data: (n_channels x n) array, ts/ts2: length-n arrays; ts2=None for a block indexed by sample indices ts
+        # Returns the RingSlot written, or None if the block does not fit or no slot freed up within timeout
+        n_channels,n = data.shape
+        if n_channels != self.n_channels or n > self.n_samples:
+            return None
+        if not self._free.acquire(True, timeout):
+            return None
+        idx = self._next
+        self._next = (self._next+1) % self.n_slots
+        rdata,rts = self._views()
+        rdata[idx,:,:n] = data
+        rts[idx,0,:n] = ts
+        if ts2 is not None:
+            rts[idx,1,:n] = ts2
+        return RingSlot(idx, n, ts2 is None)
+
+    def get(self, slot):
+        # Returns views (n x n_channels data, ts, ts2) onto a slot, ts2 being None for a sample-indexed block; call release() once they have been copied out
+        rdata,rts = self._views()
+        ts2 = None if slot.sampled else rts[slot.idx,1,:slot.n]
+        return rdata[slot.idx,:,:slot.n].T, rts[slot.idx,0,:slot.n], ts2
+
+    def release(self):
+        self._free.release()
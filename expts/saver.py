@@ -3,13 +3,24 @@ import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from util import now,now2
-from routines import add_to_saver_buffer
+from routines import add_to_saver_buffer, SharedRing, RingSlot
+from shards import shard_path, log_event
+from journal import Journal, journal_path
+from history import past_trials, last_summary, summary_ok, summarise_session, append_summary, index_trials
 
 class Saver(mp.Process):
     # To save, call saver.write() with either a dict or a numpy array
     # To end, just use the saver.end method. It will raise a kill flag, then perform a final flush.
 
-    def __init__(self, subj, sesh_name, session_obj, data_file=config.datafile, sync_flag=None, field_buffer_size=30, forced_flush_fieldnames=dict(analogreader=5)):
+    # A source's buffer is written out as soon as any condition of its flush policy is met; None disables a condition
+    # max_records: records (writes) buffered, max_rows: rows buffered, max_age: secs since the oldest buffered record, on_iti: whenever the flushing flag is raised (by the session, during ITI)
+    DEFAULT_FLUSH_POLICY = dict(max_records=None, max_rows=None, max_age=None, on_iti=False)
+
+    # HDF table options for a source, applied when its table is created (an existing table keeps its own)
+    # complib: any of tables.filters.all_complibs (e.g. 'blosc:lz4', 'blosc:zstd'), complevel: 0-9 (0 disables compression), expectedrows: rows the table is expected to reach, from which PyTables derives the chunkshape
+    DEFAULT_TABLE_OPTIONS = dict(complevel=0, complib=None, expectedrows=None)
+
+    def __init__(self, subj, sesh_name, session_obj, data_file=config.datafile, sync_flag=None, field_buffer_size=30, forced_flush_fieldnames=dict(analog=5, analog_int16=5), drain_timeout=0.1, max_drain=500, ring_shape=None, ring_slots=4, ring_dtype=np.float64, writer_queue_size=16, flush_policies={}, write_log=None, shard_dir=None, compression={}, journal_dir=None, journal_fsync=False):
         super(Saver, self).__init__()
 
         # Sync
@@ -21,15 +32,35 @@ class Saver(mp.Process):
         self.sesh_name = sesh_name
         self.session_obj = session_obj
         self.data_file = data_file
+        self.shard_dir = shard_dir # if supplied, the session is written into its own shard file there, to be merged into data_file later (see shards.py)
+        self.out_file = shard_path(self.shard_dir, self.sesh_name, self.subj.num) if self.shard_dir else self.data_file
+        self.journal_dir = journal_dir # if supplied, every write goes first to a journal there, from which it can be replayed after a crash (see journal.py)
+        self.journal_fsync = journal_fsync
         self.sesh_path = ['sessions', self.sesh_name.strftime('%Y%m%d%H%M%S')]
         self.past_trials = self.get_past_trials()
+        self.summarise = summary_ok(self.data_file) # only extend the summary table if it is complete (see history.py)
+        self.prev_summary = last_summary(self.data_file, self.shard_dir, self.subj.num) if self.summarise else None
         self.field_buffer_size = field_buffer_size
         self.forced_flush_fieldnames = forced_flush_fieldnames # used to indicate special fields that should be flushed when n items have been supplied. format: {fieldname:n}
+        self.flush_policies = flush_policies # format: {fieldname:policy}, with optional 'default' entry applying to all fields; see DEFAULT_FLUSH_POLICY
+        self.drain_timeout = drain_timeout # secs to block waiting for a record before re-checking the kill flag
+        self.max_drain = max_drain # max records pulled from the queue in one drain
+        self.writer_queue_size = writer_queue_size # max finished batches waiting on the writer thread before draining blocks
+        self.compression = compression # format: {fieldname:options}, with optional 'default' entry applying to all fields; see DEFAULT_TABLE_OPTIONS
+        for opts in self.compression.values():
+            if opts.get('complib') not in [None] + tables.filters.all_complibs:
+                raise Exception('Compression library {} is not available; options are {}'.format(opts['complib'], tables.filters.all_complibs))
 
         # Externally accessible flags and variables
         self.buf = mp.Queue()
         self.notes_q = mp.Queue()
         self.kill_flag = mp.Value('b', False)
+        self.n_backpressure = mp.Value('i', 0) # number of times draining had to wait on the writer thread
+        self.flushing = mp.Value('b', False) # while raised, sources with on_iti policies are written out
+        self.write_log = write_log # optional queue receiving (source, rows, enqueue times, now2()) after each append, for benchmarking; sample-indexed rows are enqueued when the saver received them
+        self.ring = None # shared-memory transport for large array records, format: (n_channels, n_samples)
+        if ring_shape is not None:
+            self.ring = SharedRing(*ring_shape, n_slots=ring_slots, dtype=ring_dtype)
 
         self.start()
 
@@ -44,110 +75,261 @@ class Saver(mp.Process):
             self.sync_val.value = now()
 
         # Externally inaccessible instance-specific structures
-        self.f = pd.HDFStore(self.data_file, mode='a')
+        if self.shard_dir:
+            if not os.path.exists(self.shard_dir):
+                os.makedirs(self.shard_dir)
+            log_event(self.shard_dir, self.out_file, 'open', session=self.sesh_name.isoformat(), subj=int(self.subj.num))
+        self.journal = None
+        if self.journal_dir:
+            if not os.path.exists(self.journal_dir):
+                os.makedirs(self.journal_dir)
+            self.journal = Journal(journal_path(self.journal_dir, self.sesh_name, self.subj.num), fsync=self.journal_fsync, out_file=os.path.abspath(self.out_file), session=self.sesh_name.isoformat(), subj=int(self.subj.num))
+        self.f = pd.HDFStore(self.out_file, mode='a')
     
         # Save session details
         warnings.simplefilter('ignore', tables.NaturalNameWarning)
         param_path = '/'.join(self.sesh_path + ['params'])
         code_path = '/'.join(self.sesh_path + ['code'])
         sync_path = '/'.join(self.sesh_path + ['sync'])
-        self.f.put(param_path, pd.Series(json.dumps(self.session_obj.params, cls=JSONEncoder)))
-        self.f.put(code_path, pd.Series(self.session_obj.get_code()))
-        while self.session_obj.sync_to_save.empty():
-            pass
+        self._put(param_path, pd.Series(json.dumps(self.session_obj.params, cls=JSONEncoder)))
+        self._put(code_path, pd.Series(self.session_obj.get_code()))
         sy = self.session_obj.sync_to_save
-        self.f.put(sync_path, pd.Series(sy.get()))
+        self._put(sync_path, pd.Series(sy.get()))
+
+        # Write-behind thread: from here until the final flush, only it touches the HDF store
+        self._table_opts = {}
+        self._write_q = Queue.Queue(maxsize=self.writer_queue_size)
+        self._writer_thread = threading.Thread(target=self._writer)
+        self._writer_thread.start()
 
         # main loop runtime vars
         field_buffers = {}
+        self._policies = {}
 
         # Main loop
-        # Continuously reads from buffer queue, saving data if present
+        # Blocks on buffer queue, draining everything already queued into source-specific columnar buffers
         while True:
             if self.buf.empty() and self.kill_flag.value:
                 break
-               
-            try:
-                record = self.buf.get(block=False)
-            except Queue.Empty:
-                continue
 
-            if self.kill_flag.value:
+            records = self._drain()
+
+            if records and self.kill_flag.value:
                 logging.info('Saver final flush: {} items remain.'.format(self.buf.qsize()))
-            
-            source,data,ts,ts2,columns = record
-            if not isinstance(data, pd.DataFrame):
-                data = pd.DataFrame(data, columns=columns, index=[ts])
-            elif isinstance(data, pd.DataFrame):
-                data.set_index([[ts]*len(data)], inplace=True)
-            data.ix[:,'session'] = self.sesh_name
-            data.ix[:,'subj'] = np.float64(self.subj.num)
-            data.ix[:,'ts_global'] = ts2
-
-            # add to source-specific buffer
-            if source not in field_buffers:
-                field_buffers[source] = [data]
-            elif source in field_buffers:
-                field_buffers[source].append(data)
+
+            for source,data,ts,ts2,columns in records:
+                # records sent through the shared ring carry only a slot reference
+                slot = None
+                if isinstance(data, RingSlot):
+                    slot = data
+                    data,ts,ts2 = self.ring.get(slot)
+
+                # add to source-specific buffer
+                if source not in field_buffers:
+                    field_buffers[source] = FieldBuffer()
+                fb = field_buffers[source]
+                if not fb.append(data, ts, ts2, columns):
+                    # record layout changed: write out what was buffered under the old layout first
+                    self._flush(source, fb)
+                    fb.append(data, ts, ts2, columns)
+
+                if slot is not None:
+                    self.ring.release()
 
             # write to file if pertinent
-            if len(field_buffers[source]) >= self.field_buffer_size or (source in self.forced_flush_fieldnames and len(field_buffers[source])>=self.forced_flush_fieldnames[source]):
-                to_write = pd.concat(field_buffers[source])
-                try:
-                    self.f.append(source, to_write, index=False, data_columns=['session','subj','ts_global'], complevel=0)
-                except:
-                    logging.error('Failure to save record of type \'{}\''.format(source))
-                    logging.error(sys.exc_info())
-                    with pd.HDFStore('crashdump_{:0.11f}'.format(time.time())) as cra:
-                        cra.append(source, to_write, index=False, data_columns=['session','subj','ts_global'], complevel=0)
-                    #raise
-                field_buffers[source] = []
+            t = now()
+            iti = self.flushing.value
+            for source,fb in field_buffers.items():
+                if fb.n_records and self._flush_due(source, fb, t, iti):
+                    self._flush(source, fb)
         # end main loop
 
         # final write:
         for key in field_buffers:
-            if len(field_buffers[key]):
-                to_write = pd.concat(field_buffers[key])
-            else:
-                continue
+            if field_buffers[key].n_records:
+                self._flush(key, field_buffers[key], final=True)
+        self._enqueue(None)
+        self._writer_thread.join()
+        # batches left queued by a writer thread that died
+        while not self._write_q.empty():
+            item = self._write_q.get()
+            if item is not None:
+                self._try_append(item)
+
+        # session summary, used for quick lookups of this subject's history
+        if self.summarise:
             try:
-                self.f.append(key, to_write, index=False, data_columns=['session','subj','ts_global'], complevel=0)
+                self._summarise()
             except:
-                logging.error('Failure to save record of type \'{}\' (in final saving section)'.format(key))
+                logging.error('Session summary failed to save.')
                 logging.error(sys.exc_info())
-                logging.error(to_write)
-                logging.error('orig list:')
-                logging.error(field_buffers[key])
-                with pd.HDFStore('crashdump_{:0.11f}'.format(time.time())) as cra:
-                    cra.append(key, to_write, index=False, data_columns=['session','subj','ts_global'], complevel=0)
-                #raise
-            field_buffers[key] = []
 
         notes_path = '/'.join(self.sesh_path + ['notes'])
+        notes = self.notes_q.get()
         try:
-            self.f.put(notes_path, pd.Series(json.dumps(self.notes_q.get(), cls=JSONEncoder)))
+            self._put(notes_path, pd.Series(json.dumps(notes, cls=JSONEncoder)))
         except:
             with open('crash.backup','a') as cra:
                 cra.write(str(notes))
             logging.error('Notes failed to save. Backed up into crash.backup')
 
         self.f.close()
-                    
-    def get_past_trials(self, lastlevel=True):
-        if not os.path.exists(self.data_file):
-            return None
+        if self.shard_dir:
+            log_event(self.shard_dir, self.out_file, 'complete')
+        if self.journal is not None:
+            if self.journal.pending:
+                logging.error('{} writes did not reach {}; they remain in journal {} (see expts/journal.py).'.format(len(self.journal.pending), self.out_file, self.journal.path))
+            self.journal.close(remove=not self.journal.pending)
+
+    def _drain(self):
+        # Blocks up to drain_timeout for one record, then takes whatever else is already queued
+        try:
+            records = [self.buf.get(timeout=self.drain_timeout)]
+        except Queue.Empty:
+            return []
+        while len(records) < self.max_drain:
+            try:
+                records.append(self.buf.get(block=False))
+            except Queue.Empty:
+                break
+        return records
 
-        with pd.HDFStore(self.data_file, mode='r') as f:
-            if 'trials' not in f:
-                return None
+    def flush_policy(self, source):
+        pol = dict(self.DEFAULT_FLUSH_POLICY, max_records=self.field_buffer_size)
+        pol.update(self.flush_policies.get('default', {}))
+        if source in self.forced_flush_fieldnames:
+            pol['max_records'] = self.forced_flush_fieldnames[source]
+        pol.update(self.flush_policies.get(source, {}))
+        return pol
 
-            tris = f.trials
-        
-        if len(tris) == 0:
+    def table_options(self, source):
+        opts = dict(self.DEFAULT_TABLE_OPTIONS)
+        opts.update(self.compression.get('default', {}))
+        opts.update(self.compression.get(source, {}))
+        return opts
+
+    def _flush_due(self, source, fb, t, iti):
+        pol = self._policies.get(source)
+        if pol is None:
+            pol = self._policies[source] = self.flush_policy(source)
+        return (pol['max_records'] is not None and fb.n_records >= pol['max_records']) or \
+               (pol['max_rows'] is not None and fb.n >= pol['max_rows']) or \
+               (pol['max_age'] is not None and t-fb.t_first >= pol['max_age']) or \
+               (pol['on_iti'] and iti)
+
+    def _flush(self, source, fb, final=False):
+        t_received = fb.t_received
+        self._write(source, fb.flush(self.sesh_name, self.subj.num), t_received, final=final)
+
+    def _write(self, source, to_write, t_received=None, final=False):
+        # Hands a finished batch to the writer thread, blocking only if it has fallen behind; should the writer have died, appends it here instead
+        item = (source, to_write, t_received, final)
+        if not self._enqueue(item):
+            logging.error('Saver writer thread is not running; saving record of type \'{}\' directly.'.format(source))
+            self._try_append(item)
+
+    def _enqueue(self, item):
+        # Puts item on the writer queue, waiting while the queue is full; returns False if the writer thread is dead
+        if not self._writer_thread.is_alive():
+            return False
+        try:
+            self._write_q.put(item, block=False)
+            return True
+        except Queue.Full:
+            self.n_backpressure.value += 1
+            logging.warning('Saver writer backlogged ({} batches pending); queue draining paused.'.format(self._write_q.qsize()))
+        while self._writer_thread.is_alive():
+            try:
+                self._write_q.put(item, timeout=self.drain_timeout)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _writer(self):
+        while True:
+            item = self._write_q.get()
+            if item is None:
+                break
+            self._try_append(item)
+
+    def _try_append(self, item):
+        # Nothing raised while saving a batch may stop the writer thread (or the main loop), which would leave the Saver unable to finish
+        try:
+            self._append(*item)
+        except:
+            logging.error('Unexpected failure saving record of type \'{}\''.format(item[0]))
+            logging.error(sys.exc_info())
+
+    def _append(self, source, to_write, t_received=None, final=False):
+        opts = self._table_opts.get(source)
+        if opts is None:
+            opts = self._table_opts[source] = self.table_options(source)
+        seq = self._journal_record('append', source, to_write, opts=opts)
+        try:
+            self.f.append(source, to_write, index=False, data_columns=['session','subj','ts_global'], **opts)
+        except:
+            logging.error('Failure to save record of type \'{}\'{}'.format(source, ' (in final saving section)' if final else ''))
+            logging.error(sys.exc_info())
+            if seq is None:
+                if final:
+                    logging.error(to_write)
+                self._crashdump(source, to_write)
+            #raise
+            return
+        self._journal_commit(seq)
+        if self.write_log is not None:
+            t_enqueued = to_write.ts_global.values if 'ts_global' in to_write else t_received
+            self.write_log.put((source, len(to_write), t_enqueued, now2()))
+
+    def _crashdump(self, source, to_write):
+        # Last resort for a batch that could be neither saved nor journaled; this fails too if, e.g., the disk is full
+        try:
+            with pd.HDFStore('crashdump_{:0.11f}'.format(time.time())) as cra:
+                cra.append(source, to_write, index=False, data_columns=['session','subj','ts_global'], complevel=0)
+        except:
+            logging.error('Failed to crashdump record of type \'{}\'; it is lost.'.format(source))
+            logging.error(sys.exc_info())
+
+    def _put(self, key, obj):
+        seq = self._journal_record('put', key, obj)
+        self.f.put(key, obj)
+        self._journal_commit(seq)
+
+    def _journal_record(self, kind, key, obj, **kwargs):
+        # Returns the journal seq of the record, or None if there is no journal or it could not be written
+        if self.journal is None:
+            return None
+        try:
+            return self.journal.record(kind, key, obj, **kwargs)
+        except:
+            logging.error('Failed to journal write to \'{}\''.format(key))
+            logging.error(sys.exc_info())
             return None
 
-        tris = tris[tris.subj==self.subj.num]
+    def _journal_commit(self, seq):
+        if seq is None:
+            return
+        try:
+            self.journal.commit(seq)
+        except:
+            logging.error('Failed to journal commit of write {}'.format(seq))
+            logging.error(sys.exc_info())
+
+    def _summarise(self):
+        if 'trials' not in self.f:
+            return
+        sesh = pd.Timestamp(self.sesh_name)
+        tris = self.f.select('trials', where='session == sesh')
         if len(tris) == 0:
+            return
+        append_summary(self.f, summarise_session(tris, sesh, self.subj.num, prev=self.prev_summary))
+        if not self.shard_dir:
+            index_trials(self.f)
+
+    def get_past_trials(self, lastlevel=True):
+        tris = past_trials(self.subj.num, self.data_file, self.shard_dir, lastlevel=lastlevel)
+        if tris is None or len(tris) == 0:
             return None
 
         if lastlevel:
@@ -168,6 +350,128 @@ class Saver(mp.Process):
         self.notes_q.put(notes)
         self.kill_flag.value = True
 
+class FieldBuffer(object):
+    """
+    Columnar buffer of one saver source's records, built into a DataFrame only on flush
+    Records with ts2=None are sample-indexed: ts becomes the (integer) index, and there is no ts_global column
+    """
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.columns = None
+        self.sampled = None # whether buffered records are sample-indexed
+        self.n = 0 # rows
+        self.n_records = 0 # records (one dict, array block or DataFrame each)
+        self.t_first = None # arrival time of the oldest buffered record
+        self.t_received = None # the same, in now2()
+        self._cols = None
+        self._ts = np.empty(self.capacity)
+        self._ts2 = np.empty(self.capacity)
+
+    def append(self, data, ts, ts2, columns=None):
+        # Returns False, without appending, if the record's columns (or indexing) do not match those already buffered
+        sampled = ts2 is None
+        if isinstance(data, dict):
+            cols = list(columns) if columns is not None else sorted(data.keys())
+            values = [data.get(c, np.nan) for c in cols]
+            m = 1
+        elif isinstance(data, pd.DataFrame):
+            cols = list(data.columns)
+            values = [data[c].values for c in cols]
+            m = len(data)
+        else:
+            data = np.atleast_2d(data)
+            cols = list(columns) if columns is not None else range(data.shape[1])
+            values = data.T
+            m = data.shape[0]
+
+        if self.columns is None:
+            self.columns = cols
+            self.sampled = sampled
+            self._cols = [None for _ in cols]
+        elif cols != self.columns or sampled != self.sampled:
+            return False
+
+        if self.n+m > self.capacity:
+            self._grow(self.n+m)
+
+        i0,i1 = self.n,self.n+m
+        for ci,v in enumerate(values):
+            dt = _dtype_of(v)
+            col = self._cols[ci]
+            if col is None:
+                col = self._cols[ci] = np.empty(self.capacity, dtype=dt)
+            elif dt != col.dtype and col.dtype != object:
+                if col.dtype.kind in 'biuf' and dt.kind in 'biuf':
+                    # numeric mix (bools included): upcast as pd.concat would
+                    rt = np.result_type(col.dtype, dt)
+                    if rt != col.dtype:
+                        col = self._cols[ci] = col.astype(rt)
+                else:
+                    col = self._cols[ci] = col.astype(object)
+            col[i0:i1] = v
+        self._ts[i0:i1] = ts
+        if not sampled:
+            self._ts2[i0:i1] = ts2
+        if not self.n_records:
+            self.t_first = now()
+            self.t_received = now2()
+        self.n = i1
+        self.n_records += 1
+        return True
+
+    def _grow(self, n):
+        cap = self.capacity
+        while cap < n:
+            cap *= 2
+        self._cols = [None if c is None else _resized(c, cap) for c in self._cols]
+        self._ts = _resized(self._ts, cap)
+        self._ts2 = _resized(self._ts2, cap)
+        self.capacity = cap
+
+    def flush(self, session, subj):
+        # Builds one DataFrame from the buffered columns, adding session columns vectorised, then resets
+        # The buffered arrays are handed to the frame, so fresh ones are allocated for subsequent records
+        n = self.n
+        data = {}
+        for c,col in zip(self.columns, self._cols):
+            data[c] = list(col[:n]) if col.dtype == object else col[:n]
+        data['session'] = session
+        data['subj'] = np.float64(subj)
+        if self.sampled:
+            frame = pd.DataFrame(data, index=self._ts[:n].astype(np.int64), columns=self.columns+['session','subj'])
+        else:
+            data['ts_global'] = self._ts2[:n]
+            frame = pd.DataFrame(data, index=self._ts[:n], columns=self.columns+['session','subj','ts_global'])
+
+        self.columns = None
+        self.sampled = None
+        self._cols = None
+        self.n = 0
+        self.n_records = 0
+        self.t_first = None
+        self.t_received = None
+        self._ts = np.empty(self.capacity)
+        self._ts2 = np.empty(self.capacity)
+        return frame
+
+def _dtype_of(v):
+    # dtype pandas would give v when building a frame from it
+    if isinstance(v, (bool, np.bool_)):
+        return np.dtype(bool)
+    if isinstance(v, (int, long)):
+        return np.dtype(np.int64)
+    if isinstance(v, float):
+        return np.dtype(np.float64)
+    dt = np.asarray(v).dtype
+    if dt.kind in 'SUO':
+        return np.dtype(object)
+    return dt
+
+def _resized(a, n):
+    b = np.empty(n, dtype=a.dtype)
+    b[:len(a)] = a
+    return b
+
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if hasattr(obj, '__json__'):
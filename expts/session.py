@@ -1,11 +1,12 @@
 import numpy as np
 import pandas as pd
 import time, threading, os, logging, csv, json, multiprocessing
-from hardware import AnalogReader, Valve, Light, PSEye, Speaker, default_cam_params, Opto, SICommunicator
+from hardware import AnalogReader, int16_scaling, Valve, Light, PSEye, Speaker, default_cam_params, Opto, SICommunicator
 from settings.manipulations import *
 from settings.constants import *
 from trials import TrialHandler
 from saver import Saver
+from hardware.spill import spill_path, default_spill_dir
 from util import now, email_alert
 import config
 pjoin = os.path.join
@@ -13,6 +14,7 @@ pjoin = os.path.join
 class Session(object):
 
     DEFAULT_PARAMS = {}
+    PUFF_FEATURES = ['puffl_count','puffr_count'] # per side (L,R), AnalogReader feature output counting puff monitor pulses; the puff check is skipped without them
 
     def __init__(self, session_params, mp285=None, actuator=None):
         self.params = self.DEFAULT_PARAMS
@@ -26,12 +28,21 @@ class Session(object):
         self.sync_flag = multiprocessing.Value('b', False)
         self.sync_to_save = multiprocessing.Queue()
 
+        # int16 analog samples: their conversion to volts is saved with the session params
+        if self.ar_params.get('int16'):
+            scale,offset = int16_scaling(self.ar_params.get('analog_minmax', (-10,10)))
+            self.params['ar_scaling'] = dict(scale=scale, offset=offset) # volts = counts*scale + offset
+
         # saver
-        self.saver = Saver(self.subj, self.name, self, sync_flag=self.sync_flag)
+        self.saver = Saver(self.subj, self.name, self, sync_flag=self.sync_flag, ring_shape=(len(self.ar_params['ports']), self.ar_params.get('save_buffer_size', 8000)), ring_dtype=np.int16 if self.ar_params.get('int16') else np.float64, **self.saver_params)
 
         # hardware
         self.cam = PSEye(sync_flag=self.sync_flag, **self.cam_params)
-        self.ar = AnalogReader(saver_obj_buffer=self.saver.buf, sync_flag=self.sync_flag, **self.ar_params)
+        ar_params = dict(self.ar_params)
+        if ar_params.get('spill'):
+            # samples go to a spill file, converted into the session's store after the session (see hardware/spill.py)
+            ar_params['spill'] = dict(path=spill_path(default_spill_dir(config.datafile), self.name, self.subj.num), out_file=os.path.abspath(self.saver.out_file), session=self.name.isoformat(), subj=int(self.subj.num), table_opts=self.saver.table_options('analog_int16' if ar_params.get('int16') else 'analog'))
+        self.ar = AnalogReader(saver_obj_buffer=self.saver.buf, saver_ring=self.saver.ring, sync_flag=self.sync_flag, **ar_params)
         self.stimulator = Valve(saver=self.saver, name='stimulator', **self.stimulator_params)
         self.spout = Valve(saver=self.saver, name='spout', **self.spout_params)
         self.light = Light(saver=self.saver, **self.light_params); self.light.set(0)
@@ -67,6 +78,10 @@ class Session(object):
         self.rewards_given = 0
         self.paused = 0
         self.holding = False
+        self.lick_state = [False, False] # per side, whether the subject is currently in contact with the lick port
+        self.lick_phase = None # phase in which lick_state was last checked
+        self.puff_counts = None # puff monitor pulse counts at the start of the current trial
+        self.puffs_given = np.zeros(2, dtype=int) # per side, puffs given in the current trial, hints included
         self.current_phase = PHASE_INTRO
         self.live_figure = None
         
@@ -77,6 +92,7 @@ class Session(object):
         sync_vals = {o:procs[o].sync_val.value for o in procs} #collect all process times
         sync_vals['session'] = self.sync_val
         self.sync_to_save.put(sync_vals)
+        self.ar_clock_offset = self.sync_val - sync_vals['ar'] # converts analogreader timestamps to this process's now()
 
     def name_as_str(self):
         return self.name.strftime('%Y%m%d%H%M%S')
@@ -104,8 +120,12 @@ class Session(object):
             dt = now() - t0
             if dt >= self.th.trt['time'][self.stim_idx]:
                 #logging.debug(dt-self.th.trt['time'][self.stim_idx])
-                self.stimulator.go(self.th.trt['side'][self.stim_idx])
+                self.puff(self.th.trt['side'][self.stim_idx])
                 self.stim_idx += 1
+
+    def puff(self, side):
+        self.stimulator.go(side)
+        self.puffs_given[int(side)] += 1
         
     def to_phase(self, ph):
         # Write last phase
@@ -133,11 +153,13 @@ class Session(object):
         self.phase_start = now()
         self.last_hint = now()
 
-        # Flush flag for camera:
+        # Flush flag for camera and saver:
         if ph in [PHASE_ITI, PHASE_END]:
             self.cam.flushing.value = True
+            self.saver.flushing.value = True
         else:
             self.cam.flushing.value = False
+            self.saver.flushing.value = False
 
         # Opto LED : based on constants defined in manipulations.py
         if self.th.manip == MANIP_NONE:
@@ -202,19 +224,28 @@ class Session(object):
             else:
                 self.th.end_trial(outcome, self.rewarded, nLnR)
 
+    def add_lick(self, ts, side):
+        try:
+            self.licks[self.lick_idx] = (self.current_phase, ts, side)
+            self.lick_idx += 1
+        except:
+            logging.error(self.licks)
+        if self.lick_idx >= len(self.licks):
+            self.licks.resize(len(self.licks)+2000, refcheck=False)
+
     def update_licked(self):
-        l = self.ar.licked
-        tst = now()
-        for idx,li in enumerate(l):
-            if li:
-                try:
-                    self.licks[self.lick_idx] = (self.current_phase, tst, idx)
-                    self.lick_idx += 1
-                except:
-                    logging.error(self.licks)
-                if self.lick_idx >= len(self.licks):
-                    self.licks = self.licks.resize(len(self.licks)+2000)
-                
+        # licks are timestamped with the sample at which they crossed threshold in the analogreader
+        # events are drained without blocking: a blocking get with a timeout can stall each pass for a whole timer tick (~15 ms on Windows)
+        for ts,side,onset in self.ar.get_lick_events():
+            self.lick_state[side] = onset
+            if onset:
+                self.add_lick(ts+self.ar_clock_offset, side)
+        # a contact that is ongoing when a phase begins counts as a lick in that phase
+        if self.current_phase != self.lick_phase:
+            for side,st in enumerate(self.lick_state):
+                if st:
+                    self.add_lick(now(), side)
+            self.lick_phase = self.current_phase
         
         if self.hold_rule:
             if (not self.holding) and np.any(self.ar.holding):
@@ -284,7 +315,7 @@ class Session(object):
                 return
             
             if self.th.rule_hint_delay and now()-self.last_hint > self.next_hint_interval:
-                self.stimulator.go(self.th.trial.side)
+                self.puff(self.th.trial.side)
                 self.last_hint = now()
                 
                 self.next_hint_interval = np.random.normal(*self.hint_interval)
@@ -302,7 +333,7 @@ class Session(object):
                     self.moved_ports = True
                 
             if self.th.rule_hint_delay and now()-self.last_hint > self.next_hint_interval: #and ((self.retract_ports and self.mp285.is_moving) or (not self.retract_ports)):
-                self.stimulator.go(self.th.trial.side)
+                self.puff(self.th.trial.side)
                 self.last_hint = now()
                 
                 self.next_hint_interval = np.random.normal(*self.hint_interval)
@@ -379,7 +410,7 @@ class Session(object):
                 self.rewards_given += 1
                 
             if self.th.rule_hint_reward and now()-self.last_hint > self.next_hint_interval:
-                self.stimulator.go(self.th.trial.side)
+                self.puff(self.th.trial.side)
                 self.last_hint = now()
                 
                 self.next_hint_interval = np.random.normal(*self.hint_interval)
@@ -416,7 +447,9 @@ class Session(object):
        
         # Phase reset
         self.to_phase(PHASE_INTRO)
-        _=self.ar.licked # to clear any residual signal
+        for _,side,onset in self.ar.get_lick_events(): # to clear any residual signal
+            self.lick_state[side] = onset
+        self.lick_phase = None
 
         # Check for mp285 adjustment
         if self.th.do_adjust_mp285 is not False:
@@ -430,6 +463,8 @@ class Session(object):
 
         # Event trackers
         self.stim_idx = 0
+        self.puffs_given[:] = 0
+        self.puff_counts = self.get_puff_counts()
         self.do_reward = True # until determined otherwise
         self.rewarded = False
         self.wrong_signaled = False
@@ -446,6 +481,8 @@ class Session(object):
 
         while self.current_phase != PHASE_END:
             self.run_phase()
+
+        self.check_puffs()
        
         # Return value indicating whether another trial is appropriate
         if self.session_kill:
@@ -453,6 +490,24 @@ class Session(object):
             return False
         else:
             return True
+    def get_puff_counts(self):
+        # Pulses detected so far on each side's puff monitor, or None if the AnalogReader has no such features
+        feats = self.ar.get_features()
+        if not all(f in feats for f in self.PUFF_FEATURES):
+            return None
+        return np.array([feats[f] for f in self.PUFF_FEATURES])
+
+    def check_puffs(self):
+        # Compares the puffs given this trial with the pulses the puff monitors picked up, and saves both
+        counts = self.get_puff_counts()
+        if counts is None or self.puff_counts is None:
+            return
+        detected = counts - self.puff_counts
+        given = self.puffs_given
+        self.saver.write('puff_check', dict(trial=self.th.idx, givenL=given[L], givenR=given[R], detectedL=detected[L], detectedR=detected[R]))
+        if np.any(detected != given):
+            logging.warning('Trial {}: puffs given (L,R) {} but detected {}.'.format(self.th.idx, tuple(given), tuple(detected)))
+
     def mp285_go(self, pos):
         threading.Thread(target=self.mp285.goto, args=(pos,)).start()
     def email_update(self):
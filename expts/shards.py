@@ -0,0 +1,124 @@
+"""
+Per-session shard files: the Saver can write each session into its own file in a shard directory, which merge_shards merges into the main data file between sessions.
+Shards are tracked in catalog.jsonl in the shard directory, one event (open, complete, merging, merged) per line.
+To merge manually: python -m expts.shards [data_file]
+"""
+import os, sys, json, glob, logging, warnings, tables
+import pandas as pd
+import numpy as np
+import config
+from util import now2
+
+CATALOG_NAME = 'catalog.jsonl'
+
+def default_shard_dir(data_file=config.datafile):
+    return os.path.join(os.path.dirname(os.path.abspath(data_file)), 'shards')
+
+def shard_path(shard_dir, sesh_name, subj_num):
+    return os.path.join(shard_dir, '{}_{}.h5'.format(sesh_name.strftime('%Y%m%d%H%M%S'), int(subj_num)))
+
+def log_event(shard_dir, shard, status, **kwargs):
+    event = dict(shard=os.path.basename(shard), status=status, time=now2())
+    event.update(kwargs)
+    with open(os.path.join(shard_dir, CATALOG_NAME), 'a') as f:
+        f.write(json.dumps(event) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_catalog(shard_dir):
+    """
+    Returns {shard name : dict(status, session, subj, tables_merging, tables_merged)}, where status is the latest shard-level status
+    """
+    path = os.path.join(shard_dir, CATALOG_NAME)
+    cat = {}
+    if not os.path.exists(path):
+        return cat
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue # partially written line from a crash
+            entry = cat.setdefault(ev['shard'], dict(status=None, session=None, subj=None, tables_merging=set(), tables_merged=set()))
+            if 'session' in ev:
+                entry['session'] = ev['session']
+                entry['subj'] = ev['subj']
+            if 'table' in ev:
+                entry['tables_{}'.format(ev['status'])].add(ev['table'])
+            else:
+                entry['status'] = ev['status']
+    return cat
+
+def unmerged_shards(shard_dir, subj_num=None):
+    # Paths of existing shards that have not been fully merged, oldest first
+    if shard_dir is None or not os.path.isdir(shard_dir):
+        return []
+    cat = read_catalog(shard_dir)
+    paths = []
+    for name in sorted(cat):
+        entry = cat[name]
+        if entry['status'] == 'merged':
+            continue
+        if subj_num is not None and entry['subj'] != int(subj_num):
+            continue
+        path = os.path.join(shard_dir, name)
+        if os.path.exists(path):
+            paths.append(path)
+    return paths
+
+def merge_shard(path, data_file, entry, chunksize=500000):
+    # Appends all tables of one shard into data_file, recording progress so that an interrupted merge can be resumed without duplicating rows
+    shard_dir = os.path.dirname(path)
+    sesh = pd.Timestamp(entry['session'])
+    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+    with pd.HDFStore(path, mode='r') as src, pd.HDFStore(data_file, mode='a') as dst:
+        for key in src.keys():
+            key = key.strip('/')
+            if key in entry['tables_merged']:
+                continue
+            if key.startswith('sessions'):
+                dst.put(key, src[key])
+            else:
+                if key in entry['tables_merging'] and key in dst:
+                    # a previous merge was interrupted part way through this table
+                    dst.remove(key, where='session == sesh')
+                log_event(shard_dir, path, 'merging', table=key)
+                storer = src.get_storer(key)
+                nrows = storer.nrows
+                filters = storer.table.filters # tables created by the merge keep the shard's compression
+                for i0 in range(0, nrows, chunksize):
+                    dst.append(key, src.select(key, start=i0, stop=i0+chunksize), index=False, data_columns=['session','subj','ts_global'], complevel=filters.complevel, complib=filters.complib if filters.complevel else None)
+                if key == 'trials':
+                    # keeps subject lookups indexed (see history.py); no-op once the index exists
+                    dst.create_table_index('trials', columns=['subj','session'], optlevel=6, kind='medium')
+            log_event(shard_dir, path, 'merged', table=key)
+    log_event(shard_dir, path, 'merged')
+
+def merge_shards(shard_dir=None, data_file=config.datafile, remove=True):
+    """
+    Merges unmerged shards into data_file, oldest first (no saver may be writing to shard_dir), and returns how many
+    """
+    if shard_dir is None:
+        shard_dir = default_shard_dir(data_file)
+    cat = read_catalog(shard_dir)
+    n = 0
+    for path in unmerged_shards(shard_dir):
+        entry = cat[os.path.basename(path)]
+        if entry['status'] == 'open':
+            logging.warning('Shard {} was not closed by its saver; merging what it contains.'.format(path))
+        try:
+            merge_shard(path, data_file, entry)
+        except:
+            logging.error('Failed to merge shard {}; it remains in place.'.format(path))
+            logging.error(sys.exc_info())
+            continue
+        n += 1
+        if remove:
+            os.remove(path)
+    if n:
+        logging.info('Merged {} session shard(s) into {}.'.format(n, data_file))
+    return n
+
+if __name__ == '__main__':
+    data_file = sys.argv[1] if len(sys.argv) > 1 else config.datafile
+    print('Merged {} shard(s).'.format(merge_shards(default_shard_dir(data_file), data_file)))
@@ -59,6 +59,9 @@ class View(wx.Frame):
         self.manip_lab = wx.StaticText(self.panel_top, label='Manip: ', style=wx.ALIGN_RIGHT)
         self.manip_widg = wx.TextCtrl(self.panel_top)
         self.manip_widg.SetEditable(False)
+        self.video_lab = wx.StaticText(self.panel_top, label='Video: ', style=wx.ALIGN_RIGHT)
+        self.video_widg = wx.TextCtrl(self.panel_top)
+        self.video_widg.SetEditable(False)
         self.panel_top_sizer.Add(self.trial_n_lab, flag=wx.ALIGN_RIGHT, proportion=1)
         self.panel_top_sizer.Add(self.trial_n_widg, flag=wx.EXPAND|wx.ALL, proportion=1)
         self.panel_top_sizer.Add(self.session_runtime_lab, flag=wx.ALIGN_RIGHT, proportion=1)
@@ -71,6 +74,8 @@ class View(wx.Frame):
         self.panel_top_sizer.Add(self.bias_widg,flag=wx.EXPAND|wx.ALL, proportion=1)
         self.panel_top_sizer.Add(self.manip_lab, flag=wx.ALIGN_RIGHT, proportion=1)
         self.panel_top_sizer.Add(self.manip_widg,flag=wx.EXPAND|wx.ALL, proportion=1)
+        self.panel_top_sizer.Add(self.video_lab, flag=wx.ALIGN_RIGHT, proportion=1)
+        self.panel_top_sizer.Add(self.video_widg,flag=wx.EXPAND|wx.ALL, proportion=1)
         self.panel_top.SetSizerAndFit(self.panel_top_sizer)
         
         # 2nd from top panel
@@ -342,10 +347,16 @@ class View(wx.Frame):
             for fr,imd in zip(data,self.movdata):
                 imd.set_data(fr)
             self.fig.canvas.draw()
-    def set_lick_data(self, data):
+    def set_lick_data(self, data, ts=None):
+        # ts: timestamps of data's samples; if supplied, data is plotted against time (secs before the latest sample) rather than sample number
         with self.fig_lock:
+            n = min(self.n_lick_show, len(data[0])) # the reader's accum_size may be shorter than n_lick_show
+            x = np.arange(n)
+            if ts is not None and 0 < ts[-n] < ts[-1]: # until the buffer has filled, unwritten samples have ts 0
+                x = ts[-n:] - ts[-1]
+                self.ax_lick.set_xlim([x[0],0])
             for d,line in zip(data,[self.lick_data1,self.lick_data2,self.wheel_data]):
-                line.set_ydata(d[-self.n_lick_show:])
+                line.set_data(x, d[-n:])
             self.fig.canvas.draw()
     def set_trial_data(self, th, sesh):
         times = th.trt['time']
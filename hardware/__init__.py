@@ -1,5 +1,5 @@
 from config import *
-from analog_reader import AnalogReader
+from analog_reader import AnalogReader, int16_scaling
 from valve import Valve
 from light import Light
 from opto import Opto
@@ -3,19 +3,25 @@ import multiprocessing as mp
 import numpy as np
 import pylab as pl
 from daq import DAQIn
+from ring_buffer import RingBuffer, SeqlockRing
+from features import make_feature
+from sample_clock import SampleClock
+from spill import SpillWriter
 from expts.routines import add_to_saver_buffer
 from util import now,now2
 
+def int16_scaling(analog_minmax=(-10,10)):
+    # (scale, offset) by which analog_minmax maps onto int16 counts, volts = counts*scale + offset
+    minn,maxx = analog_minmax
+    return (maxx-minn)/65534., (maxx+minn)/2.
+
 class AnalogReader(mp.Process):
     """
     Instantiates a new process that handles a DAQIn object.
-    The main thread constantly checks the DAQIn for anything in its data_q, saving it when there, and also making it available to public requests, like the exp interface
+    The main thread constantly checks the DAQIn for new reads in its ring, saving them, and also making them available to public requests, like the exp interface
     """
 
-    READ_BUF_SIZE = 10
-    ACCUM_SIZE = 2000 # Must be multiple of READ_BUF_SIZE
-
-    def __init__(self, ports=['ai0','ai1','ai5','ai6'], portnames=['lickl','lickr','puffl','puffr'], runtime_ports=[0,1], lickport_ports=[0,1], moving_port=2, moving_magnitude=5., lick_thresh=6., holding_thresh=1.0, moving_thresh=1.0, daq_sample_rate=500., save_buffer_size=8000, saver_obj_buffer=None, sync_flag=None, **daq_kwargs):
+    def __init__(self, ports=['ai0','ai1','ai5','ai6'], portnames=['lickl','lickr','puffl','puffr'], runtime_ports=[0,1], lickport_ports=[0,1], moving_port=2, moving_magnitude=5., lick_thresh=6., lick_hysteresis=0., lick_debounce=0., holding_thresh=1.0, moving_thresh=1.0, features=[], feature_history=500, clock_window=1000, daq_sample_rate=500., read_buf_size=10, accum_size=2000, save_buffer_size=8000, saver_obj_buffer=None, saver_ring=None, spill=None, int16=False, sync_flag=None, **daq_kwargs):
         super(AnalogReader, self).__init__()
         self.daq_kwargs = daq_kwargs
         
@@ -31,22 +37,45 @@ class AnalogReader(mp.Process):
         self.moving_port = moving_port # index *of runtime_ports* that corresponds to wheel sensor
         self._lickport_idxs = np.asarray(self.runtime_ports)[self.lickport_ports]
         self.daq_sample_rate = daq_sample_rate
+        self.read_buf_size = read_buf_size # samples per DAQ read (i.e. per callback and queue item)
+        self.accum_size = accum_size # samples in the accumulator (runtime analysis buffer)
+        self.int16 = int16 # samples are acquired, buffered and saved as int16 counts (to analog_int16), and converted to volts only for runtime analysis
+        self.scale,self.offset = int16_scaling(self.daq_kwargs.get('analog_minmax', (-10,10))) if self.int16 else (1.,0.)
+        self.save_key = 'analog_int16' if self.int16 else 'analog'
+        self.sample_clock = SampleClock(self.daq_sample_rate, window=clock_window) # fit of host time against sample index, over the last ~clock_window reads
+        self.n_samples = 0 # samples read so far, i.e. index of the next sample
+        self.n_reads = 0 # reads so far, dropped ones included, i.e. sequence number of the next read
+        self._read_idxs = np.arange(self.read_buf_size)
         
         # Data processing parameters
         self.thresh = lick_thresh
+        self.lick_hysteresis = lick_hysteresis # volts: a lick onset is a crossing above thresh, its offset a crossing below thresh-lick_hysteresis
+        self.lick_debounce = lick_debounce # secs after a lick onset/offset during which further crossings on that side are ignored
         self.holding_thresh = int(holding_thresh * self.daq_sample_rate)
         self.moving_thresh = int(moving_thresh * self.daq_sample_rate)
         self.moving_magnitude = moving_magnitude
+        self._buffer_thresh = (self.thresh-self.offset)/self.scale # thresh and moving_magnitude in the units of the save buffer
+        self._buffer_moving_magnitude = self.moving_magnitude/self.scale
 
         # data containers
-        self.accum = np.zeros((len(self.ports),self.ACCUM_SIZE))
-        self.accum_ts = []
-        self.accum_q = mp.Array('d', len(self.runtime_ports)*self.ACCUM_SIZE)
+        self.runtime_window = SeqlockRing(len(self.runtime_ports)+1, self.accum_size) # accumulator published to other processes: runtime_ports, then timestamps (now())
+        self._window_block = np.zeros([len(self.runtime_ports)+1, self.read_buf_size])
 
         # processing containers
         self.licked_ = mp.Array('b', [False, False])
+        self.lick_events = mp.Queue() # (ts, side, onset) for each lick onset (onset=True) and offset, ts being that of the sample (now())
+        self._lick_state = np.zeros(len(self.lickport_ports), dtype=int) # debounced state per side, as last reported in lick_events
+        self._lick_level = np.zeros(len(self.lickport_ports), dtype=int) # state per side after hysteresis, before debounce
+        self._lick_lockout = np.zeros(len(self.lickport_ports)) # per side, time until which crossings are ignored
         self.holding_ = mp.Value('b', False)
         self.moving_ = mp.Value('b', False)
+
+        # feature stage (see features.py): one row of all feature outputs per read, published with that read's timestamp (now())
+        self.features = [make_feature(sample_rate=self.daq_sample_rate, **f) for f in features]
+        self._feature_idxs = [self.portnames.index(f.channel) for f in self.features]
+        self.feature_names = [n for f in self.features for n in f.output_names]
+        self.feature_window = SeqlockRing(len(self.feature_names)+1, feature_history)
+        self._feature_block = np.zeros([len(self.feature_names)+1, 1])
         
         # threading structures
         self.logic_lock = mp.Lock()
@@ -54,10 +83,18 @@ class AnalogReader(mp.Process):
         # saving
         self._saving = mp.Value('b', False)
         self.save_buffer_size = save_buffer_size
+        if self.save_buffer_size % self.read_buf_size:
+            raise Exception('save_buffer_size ({}) must be a multiple of read_buf_size ({})'.format(self.save_buffer_size, self.read_buf_size))
         self.n_added_to_save_buffer = 0
-        self.save_buffer = np.zeros([len(self.ports),self.save_buffer_size])
-        self.save_buffer_ts = np.zeros([2,self.save_buffer_size])
+        ring_size = max(self.save_buffer_size, self.accum_size, self.holding_thresh, self.moving_thresh)
+        self.save_buffer = RingBuffer(len(self.ports), ring_size, dtype=np.int16 if self.int16 else np.float64) # its most recent samples also serve as the accumulator and the holding/moving windows
+        self.read_stamps = RingBuffer(3, self.save_buffer_size//self.read_buf_size) # per read: index of its last sample, ts, ts2
+        self._read_stamp = np.zeros([3,1])
+        self._gap_read = np.full([len(self.ports), self.read_buf_size], 0 if self.int16 else np.nan, dtype=self.save_buffer.buf.dtype) # saved in place of reads dropped by the DAQ
         self.saver_obj_buffer = saver_obj_buffer
+        self.saver_ring = saver_ring # if supplied, dumps go through this shared-memory ring instead of being pickled into saver_obj_buffer
+        self.spill = spill # if supplied, dict(path, **metadata): samples are written to a spill file at path instead of being sent to the saver, which gets only the read stamps (see spill.py)
+        self._spill = None
 
         self._on = mp.Value('b', True)
         self._kill_flag = mp.Value('b', False)
@@ -88,7 +125,7 @@ class AnalogReader(mp.Process):
         while not self.sync_flag.value:
             self.sync_val.value = now()
 
-        self.daq = DAQIn(ports=self.ports, read_buffer_size=self.READ_BUF_SIZE, sample_rate=self.daq_sample_rate, **self.daq_kwargs)
+        self.daq = DAQIn(ports=self.ports, read_buffer_size=self.read_buf_size, sample_rate=self.daq_sample_rate, quantise=(self.scale,self.offset) if self.int16 else None, **self.daq_kwargs)
         
         while self._on.value:
             
@@ -96,56 +133,167 @@ class AnalogReader(mp.Process):
                 self.daq.release()
 
             try:
-                ts,ts2,dat = self.daq.data_q.get(timeout=0.5)
+                seq,ts,ts2,dat = self.daq.ring.get(timeout=0.5)
             except Queue.Empty:
             
                 if self._kill_flag.value:
                    # final dump:
                     if self.n_added_to_save_buffer:
-                        add_to_saver_buffer(self.saver_obj_buffer, 'analogreader', self.save_buffer[:,-self.n_added_to_save_buffer:].T.copy(), ts=self.save_buffer_ts[0,-self.n_added_to_save_buffer:].copy(), ts2=self.save_buffer_ts[1,-self.n_added_to_save_buffer:].copy(), columns=self.portnames)
+                        self._dump(self.n_added_to_save_buffer)
+                    if self._spill is not None:
+                        self._spill.close()
                     self._on.value = False
                     
                 continue
 
             if self._kill_flag.value:
-                logging.info('Analogreader final flush: {} reads remain.'.format(self.daq.data_q.qsize()))
+                logging.info('Analogreader final flush: {} reads remain.'.format(self.daq.ring.qsize()))
+
+            # reads the DAQ had to drop (ring full) are saved as gap reads, so that saved samples keep the DAQ's sample indices
+            missed = seq - self.n_reads
+            if missed:
+                logging.error('AnalogReader fell behind the DAQ: {} reads dropped, saved as {}.'.format(missed, 'zeros' if self.int16 else 'NaN'))
+                for _ in xrange(missed):
+                    self._store(self._gap_read, np.nan, np.nan)
+            self.n_reads = seq + 1
 
-            dat = dat.reshape((len(self.ports),self.READ_BUF_SIZE))
-            
             # update save buffer with new data
-            self.save_buffer = np.roll(self.save_buffer, -self.READ_BUF_SIZE, axis=1)
-            self.save_buffer_ts = np.roll(self.save_buffer_ts, -self.READ_BUF_SIZE, axis=1)
-            self.save_buffer[:,-self.READ_BUF_SIZE:] = dat[:,:]
-            self.save_buffer_ts[:,-self.READ_BUF_SIZE:] = np.array([ts,ts2])[:,None]
-            if self._saving.value:
-                self.n_added_to_save_buffer += self.READ_BUF_SIZE
-                dump = self.n_added_to_save_buffer >= self.save_buffer_size
-            else:
-                dump = False
+            dat = dat.reshape((len(self.ports),self.read_buf_size))
+            self._store(dat, ts, ts2)
+
+            # time of each sample (now()), from the sample clock
+            self.sample_clock.update(self.n_samples-1, ts, ts2)
+            t,_ = self.sample_clock.times(self.n_samples-self.read_buf_size+self._read_idxs)
 
-            # update accumulator (runtime analysis buffer)
-            self.accum = np.roll(self.accum, -self.READ_BUF_SIZE, axis=1)
-            self.accum[:,-self.READ_BUF_SIZE:] = dat[:,:]
-            self.accum_ts += [ts]*self.READ_BUF_SIZE
-            self.accum_q[:] = (self.accum.copy()[self.runtime_ports]).ravel()
+            if self.int16:
+                dat = dat*self.scale + self.offset # volts, for runtime analysis
+
+            # publish new samples of accumulator (runtime analysis buffer)
+            self._window_block[:-1] = dat[self.runtime_ports]
+            self._window_block[-1] = t
+            self.runtime_window.write(self._window_block)
             
+            # lick events
+            self._detect_licks(dat[self._lickport_idxs], t)
+
+            # features
+            if self.features:
+                self._update_features(dat, t)
+
             # update experimental logic
             with self.logic_lock:
                 
                 self.licked_[:] = np.any(dat[self._lickport_idxs,:]>=self.thresh, axis=1)
-                self.holding_.value = np.any(np.all(self.accum[self._lickport_idxs,-self.holding_thresh:]>self.thresh, axis=1))
+                self.holding_.value = np.any(np.all(self.save_buffer.last(self.holding_thresh)[self._lickport_idxs]>self._buffer_thresh, axis=1))
                 if self.moving_port is not None:
-                    _tmp_moving = self.accum[self.runtime_ports[self.moving_port], -self.moving_thresh:]
-                    self.moving_.value = np.max(_tmp_moving)-np.min(_tmp_moving) > self.moving_magnitude
-
-            if dump and self._saving.value:
-                if self.n_added_to_save_buffer > self.save_buffer_size:
-                    warnings.warn('DAQ save buffer size larger than expected: some samples were missed. Size={}, Expected={}'.format(self.n_added_to_save_buffer,self.save_buffer_size))
-                add_to_saver_buffer(self.saver_obj_buffer, 'analogreader', self.save_buffer.T.copy(), ts=self.save_buffer_ts[0,:].copy(), ts2=self.save_buffer_ts[1,:].copy(), columns=self.portnames)
-                self.n_added_to_save_buffer = 0
+                    _tmp_moving = self.save_buffer.last(self.moving_thresh)[self.runtime_ports[self.moving_port]]
+                    self.moving_.value = float(np.max(_tmp_moving))-np.min(_tmp_moving) > self._buffer_moving_magnitude
+
+            self.daq.ring.release()
+
+    def _store(self, dat, ts, ts2):
+        # Adds one read to the save buffer (and spill file), sending the save buffer to the saver whenever it fills
+        self.save_buffer.write(dat)
+        self.n_samples += self.read_buf_size
+        self._read_stamp[:,0] = [self.n_samples-1, ts, ts2]
+        self.read_stamps.write(self._read_stamp)
+        if not self._saving.value:
+            return
+
+        if self.spill:
+            if self._spill is None:
+                opts = dict(dtype=np.int16 if self.int16 else np.float32, key=self.save_key, scale=self.scale, offset=self.offset)
+                opts.update(self.spill)
+                self._spill = SpillWriter(first_sample=self.n_samples-self.read_buf_size, n_channels=len(self.ports), columns=self.portnames, **opts)
+            self._spill.write(dat)
+
+        self.n_added_to_save_buffer += self.read_buf_size
+        if self.n_added_to_save_buffer >= self.save_buffer_size:
+            if self.n_added_to_save_buffer > self.save_buffer_size:
+                warnings.warn('DAQ save buffer size larger than expected: some samples were missed. Size={}, Expected={}'.format(self.n_added_to_save_buffer,self.save_buffer_size))
+            self._dump(self.save_buffer_size)
+            self.n_added_to_save_buffer = 0
+
+    def _detect_licks(self, dat, t):
+        # Finds lick onsets/offsets sample by sample in one read of the lick ports (sides x samples, sample times t), and pushes them onto lick_events
+        for side,x in enumerate(dat):
+            # hysteresis: 1 above thresh, 0 below thresh-lick_hysteresis, and in between, whatever the previous sample was
+            level = np.where(x>=self.thresh, 1, np.where(x<self.thresh-self.lick_hysteresis, 0, -1))
+            last = np.where(level>=0, np.arange(len(level)), -1)
+            np.maximum.accumulate(last, out=last)
+            level = np.where(last>=0, level[last], self._lick_level[side])
+            self._lick_level[side] = level[-1]
+
+            # debounce: a change of state is reported only once the previous one's lockout has passed
+            state = self._lick_state[side]
+            i = 0
+            while True:
+                changes = (level[i:]!=state) & (t[i:]>=self._lick_lockout[side])
+                if not changes.any():
+                    break
+                i += np.argmax(changes)
+                state = level[i]
+                self._lick_lockout[side] = t[i] + self.lick_debounce
+                self.lick_events.put((t[i], side, bool(state)))
+                i += 1
+            self._lick_state[side] = state
+
+    def _update_features(self, dat, t):
+        self._feature_block[:-1,0] = [v for f,idx in zip(self.features,self._feature_idxs) for v in f.process(dat[idx], t)]
+        self._feature_block[-1,0] = t[-1]
+        self.feature_window.write(self._feature_block)
+
+    def get_features(self):
+        # Latest value of each feature output, by name, with 'ts' the timestamp (now()) of the read they were computed on
+        snap = self.feature_window.read()[:,-1]
+        return dict(zip(self.feature_names+['ts'], snap))
+
+    def get_feature_history(self):
+        # (dict of the last feature_history values of each feature output by name, their timestamps); before that many reads, the oldest entries are zeros
+        snap = self.feature_window.read()
+        return dict(zip(self.feature_names, snap[:-1])), snap[-1]
+
+    def get_lick_events(self, timeout=None):
+        # Returns the list of lick events since the last call, waiting up to timeout secs for at least one (None: do not wait)
+        events = []
+        try:
+            if timeout is None:
+                events.append(self.lick_events.get(block=False))
+            else:
+                events.append(self.lick_events.get(timeout=timeout))
+            while True:
+                events.append(self.lick_events.get(block=False))
+        except Queue.Empty:
+            pass
+        return events
+
+    def _dump(self, n):
+        # Sends the last n samples of the save buffer to the saver, indexed by sample, through the shared ring when possible
+        # and the stamps of the reads they came in, from which each sample's time follows (see sample_clock.py)
+        stamps = self.read_stamps.last(n//self.read_buf_size)
+        add_to_saver_buffer(self.saver_obj_buffer, 'analog_blocks', stamps[0].astype(np.int64)[:,None], ts=stamps[1].copy(), ts2=stamps[2].copy(), columns=['sample'])
+        if self._spill is not None:
+            return
+        data = self.save_buffer.last(n)
+        samples = np.arange(self.n_samples-n, self.n_samples)
+        if self.saver_ring is not None:
+            slot = self.saver_ring.put(data, samples, None)
+            if slot is not None:
+                add_to_saver_buffer(self.saver_obj_buffer, self.save_key, slot, columns=self.portnames)
+                return
+            logging.warning('Saver ring unavailable, sending analog dump through the saver queue.')
+        add_to_saver_buffer(self.saver_obj_buffer, self.save_key, data.T.copy(), columns=self.portnames, samples=samples)
     
     def get_accum(self):
-        return np.frombuffer(self.accum_q.get_obj()).reshape([len(self.runtime_ports), self.ACCUM_SIZE])
+        return self.runtime_window.read()[:-1]
+
+    def get_accum_ts(self):
+        return self.runtime_window.read()[-1]
+
+    def get_accum_snapshot(self):
+        # (accum, accum timestamps), from the same instant
+        snap = self.runtime_window.read()
+        return snap[:-1],snap[-1]
     
     def begin_saving(self):
         self.n_added_to_save_buffer = 0
@@ -160,10 +308,10 @@ if __name__ == '__main__':
     pl.figure()
     lr = AnalogReader()
     lr.start()
-    show_lines = pl.plot(lr.accum.T)
+    show_lines = pl.plot(lr.get_accum().T)
     pl.ylim([-.1,10.1])
     while True:
         for idx,sl in enumerate(show_lines):
-            sl.set_ydata(lr.accum[idx])
+            sl.set_ydata(lr.get_accum()[idx])
         pl.draw()
         pl.pause(0.001)
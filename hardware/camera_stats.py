@@ -0,0 +1,91 @@
+"""
+Frame counts for each camera at every stage of the pipeline (driver, frame ring, MovieSaver, movie file), so that lost frames show up as differences between counts.
+Frames acquired while saving all reached the movie file when written == acquired_saving and skipped is 0 (see CameraStats.get).
+"""
+import ctypes
+import multiprocessing as mp
+import numpy as np
+from util import now2
+
+COUNTS = ['acquired', 'acquired_saving', 'enqueued', 'dropped', 'dropped_saving', 'taken', 'to_save', 'written', 'depth', 'depth_max'] # *_saving and to_save count frames acquired while saving; depth is frames left in the ring
+_I = {c:i for i,c in enumerate(COUNTS)}
+INTERVAL_EDGES = np.append(np.arange(251)*0.001, np.inf) # secs
+LATENCY_EDGES = np.concatenate([[0.], np.logspace(-3, 3, 61), [np.inf]]) # secs
+
+class CameraStats(object):
+    """
+    Shared counts for n_cams cameras, acquiring at frame_rates (one per camera)
+    Each count has a single writer thread, so there is no lock.
+    """
+    def __init__(self, n_cams, frame_rates):
+        self.n_cams = n_cams
+        self.frame_rates = frame_rates
+        self._counts = mp.RawArray(ctypes.c_ulonglong, n_cams*len(COUNTS))
+        self._interval = mp.RawArray(ctypes.c_ulonglong, n_cams*(len(INTERVAL_EDGES)-1))
+        self._latency = mp.RawArray(ctypes.c_ulonglong, n_cams*(len(LATENCY_EDGES)-1))
+        self._latency_max = mp.RawArray('d', n_cams)
+        self._last_ts = mp.RawArray('d', n_cams) # now() of each camera's previous frame
+
+    def _view(self, arr, dtype=np.uint64):
+        return np.frombuffer(arr, dtype=dtype).reshape([self.n_cams, -1])
+
+    def acquired(self, idx, ts, enqueued, saving):
+        # Acquisition thread of camera idx: a frame came from the driver at now() ts, and was enqueued (or dropped)
+        c = self._view(self._counts)[idx]
+        c[_I['acquired']] += 1
+        c[_I['enqueued' if enqueued else 'dropped']] += 1
+        if saving:
+            c[_I['acquired_saving']] += 1
+            if not enqueued:
+                c[_I['dropped_saving']] += 1
+        if self._last_ts[idx]:
+            dt = ts - self._last_ts[idx]
+            self._view(self._interval)[idx, min(int(dt/INTERVAL_EDGES[1]), len(INTERVAL_EDGES)-2)] += 1
+        self._last_ts[idx] = ts
+
+    def taken(self, idx, saving, depth):
+        # MovieSaver writer of camera idx: took a frame from the ring, leaving depth frames in it
+        c = self._view(self._counts)[idx]
+        c[_I['taken']] += 1
+        if saving:
+            c[_I['to_save']] += 1
+        c[_I['depth']] = depth
+        c[_I['depth_max']] = max(c[_I['depth_max']], depth)
+
+    def written(self, idx, ts2):
+        # MovieSaver writer of camera idx: wrote frames acquired at now2() stamps ts2
+        lat = now2() - np.asarray(ts2)
+        self._view(self._counts)[idx, _I['written']] += len(lat)
+        bins = np.searchsorted(LATENCY_EDGES, lat, side='right') - 1
+        self._view(self._latency)[idx] += np.bincount(np.clip(bins, 0, len(LATENCY_EDGES)-2), minlength=len(LATENCY_EDGES)-1).astype(np.uint64)
+        if len(lat):
+            self._latency_max[idx] = max(self._latency_max[idx], np.max(lat))
+
+    def get(self, idx):
+        # Stats of camera idx: its counts and histograms, skipped (frames the camera skipped, estimated from intervals over 1.5 frame periods) and missing (frames acquired while saving but not yet written)
+        st = dict(zip(COUNTS, [int(c) for c in self._view(self._counts)[idx]]))
+        st['interval_hist'] = self._view(self._interval)[idx].copy()
+        st['latency_hist'] = self._view(self._latency)[idx].copy()
+        st['latency_max'] = self._latency_max[idx]
+        periods = np.round(INTERVAL_EDGES[:-1]*self.frame_rates[idx] + 0.5*INTERVAL_EDGES[1]*self.frame_rates[idx]) # bin centres, in frame periods
+        periods[-1] = max(periods[-1], 2) # anything in the last bin skipped at least one frame
+        late = INTERVAL_EDGES[:-1] >= 1.5/self.frame_rates[idx]
+        st['skipped'] = int(np.sum(st['interval_hist'][late]*(periods[late]-1)))
+        st['missing'] = st['acquired_saving'] - st['written']
+        return st
+
+    def save(self, f, idx):
+        # Saves the stats of camera idx to the open h5py File f, as group stats{idx}
+        st = self.get(idx)
+        g = f.create_group('stats{}'.format(idx))
+        for k in COUNTS + ['skipped', 'missing', 'latency_max']:
+            g.attrs[k] = st[k]
+        g.attrs['frame_rate'] = self.frame_rates[idx]
+        g.create_dataset('interval_hist', data=st['interval_hist'])
+        g.create_dataset('interval_edges', data=INTERVAL_EDGES)
+        g.create_dataset('latency_hist', data=st['latency_hist'])
+        g.create_dataset('latency_edges', data=LATENCY_EDGES)
+
+def describe(stats):
+    # One line summary of a list of camera stats (as from PSEye.get_stats), for display
+    return ' | '.join('{written}/{acquired_saving} drop {dropped_saving} skip {skipped} q {depth}'.format(**st) for st in stats)
@@ -5,6 +5,9 @@ import os, time, json, sys, warnings, ctypes, logging, threading, h5py, Queue
 import numpy as np
 import multiprocessing as mp
 from util import now,now2
+from ring_buffer import FrameRing
+from video_codecs import make_codec
+from camera_stats import CameraStats
 
 if TESTING_MODE:
     from dummy import PSEye, default_cam_params
@@ -63,7 +66,11 @@ elif not TESTING_MODE:
         return np.frombuffer(a.get_obj(), dtype=np.uint8)
 
     class MovieSaver(mp.Process):
-        def __init__(self, name, kill_flag, frame_buffer, flushing, buffer_size=2000, hdf_resize=30000, min_flush=200, n_cams=1, resolution=None):
+        """
+        Saves each camera's frames from its FrameRing to an hdf5 file, as datasets mov{i} (frames) and ts{i} (now(),now2() of each frame)
+        Each camera's writer thread compresses whole chunks itself (see video_codecs) and writes them with direct chunk writes, holding them until flushing or buffer_size frames are pending
+        """
+        def __init__(self, name, kill_flag, frame_buffer, flushing, buffer_size=2000, hdf_resize=30000, min_flush=200, n_cams=1, resolution=None, frame_shapes=None, chunk_frames=14, codec='gzip:1', stats=None):
             super(MovieSaver, self).__init__()
             self.daemon = True
 
@@ -74,117 +81,142 @@ elif not TESTING_MODE:
             self.buffer_size = buffer_size # should be overkill, since flushing will do the real job of saving it out
             self.hdf_resize = hdf_resize
             self.min_flush = min_flush
+            self.chunk_frames = chunk_frames
+            self.codec = codec
+            make_codec(self.codec) # fails here, rather than in the saving process, if the codec is unknown or its package is missing
             
             # Cam params
             self.n_cams = n_cams
             self.resolution = resolution
+            self.frame_shapes = frame_shapes or [tuple(r[::-1]) for r in self.resolution] # (y,x), or (y,x,bytes per pixel) for colour
 
             # Flags and containers
-            self.saving_complete = mp.Value('b', False)
+            self.saving_complete = mp.Event()
             self.kill_flag = kill_flag
             self.flushing = flushing
             self.frame_buffer = frame_buffer
+            self.stats = stats # CameraStats, optional
             
-            # Queries
-            self.query_flag = mp.Value('b',False)
-            self.query_queue = mp.Array(ctypes.c_uint8, np.sum([np.product(r) for r in self.resolution]))
+            # Queries: one flag per camera, cleared by its writer once it has copied a frame into query_queue
+            self.query_flag = mp.Array('b', [False]*self.n_cams)
+            self.query_queue = mp.Array(ctypes.c_uint8, int(np.sum([np.product(fs) for fs in self.frame_shapes])))
             
             self.start()
         def run(self):
             
+            self._codec = make_codec(self.codec)
+
             # Setup hdf5 file and datasets
             self.vw_f = h5py.File(self.name,'w')
             self.vw,self.vwts = [],[]
             for i in range(self.n_cams):
-                x,y = self.resolution[i]
-                vw = self.vw_f.create_dataset('mov{}'.format(i), (self.hdf_resize, y, x), maxshape=(None, y, x), dtype='uint8', chunks=(14,y,x), compression='lzf') 
+                fs = self.frame_shapes[i]
+                vw = self.vw_f.create_dataset('mov{}'.format(i), (self.hdf_resize,)+fs, maxshape=(None,)+fs, dtype='uint8', chunks=(self.chunk_frames,)+fs, **self._codec.dataset_opts())
+                vw.attrs['codec'] = self.codec
                 vwts = self.vw_f.create_dataset('ts{}'.format(i), (self.hdf_resize,2), maxshape=(None,2), dtype=np.float64, compression='lzf')
                 self.vw.append(vw)
                 self.vwts.append(vwts)
-               
-            # Counters and buffers
-            _sav_idx = [0]*self.n_cams # index within hdf5 dataset
-            _buf_idx = [0]*self.n_cams # index of in-memory buffer that is periodicially dumped to hdf5 dataset
-            _saving_buf,_saving_ts_buf = [],[]
-            for i in range(self.n_cams):
-                x,y = self.resolution[i]
-                sb = np.empty((self.buffer_size,y,x), dtype=np.uint8)
-                stb = np.empty((self.buffer_size,2), dtype=np.float64)
-                _saving_buf.append(sb)
-                _saving_ts_buf.append(stb)
-
-            cams_running = [True for i in range(self.n_cams)]
-
-            # Main loop
-            while any(cams_running):
-                # For all datasets: if there's not enough room to dump another buffer's worth into dataset, extend it
-                # Then read new frames, and save/query as desired
+            self._lock = threading.Lock() # for all access to the file
+
+            writers = [threading.Thread(target=self._write, args=(di,)) for di in range(self.n_cams)]
+            for w in writers:
+                w.start()
+            for w in writers:
+                w.join()
+
+            # frame accounting, saved next to the movies
+            if self.stats is not None:
                 for di in range(self.n_cams):
-                    if not cams_running[di]:
-                        continue
-                    
-                    if self.vw[di].shape[0]-_sav_idx[di] <= self.buffer_size:
-                        assert self.vw[di].shape[0] == self.vwts[di].shape[0], 'Frame and timestamp dataset lengths are mismatched.'
-                        self.vw[di].resize((self.vw[di].shape[0]+self.hdf_resize, self.vw[di].shape[1], self.vw[di].shape[2]))
-                        self.vwts[di].resize((self.vwts[di].shape[0]+self.hdf_resize,self.vwts[di].shape[1]))
-               
-                    # Get new frames from buffer, breaking out if empty and kill flag has been raised
-                    ts=temp=bsave=None
-                    try:
-                        ts,temp,bsave = self.frame_buffer[di].get(block=False)
-                    except Queue.Empty:
-                        if self.kill_flag.value:
-                            cams_running[di] = False
-                        continue
-
-                    if self.kill_flag.value==True:
-                        logging.info('Final flush for camera {}: {} frames remain.'.format(di, self.frame_buffer[di].qsize()))
-                                 
-                    if self.query_flag.value:
-                        res = self.resolution[di]
-                        if di == 0:
-                            start = 0
-                        else:
-                            start = np.product(self.resolution[:di])
-                        self.query_queue[start:start+np.product(res)] = temp.copy()
-                        if di == self.n_cams-1:
-                            self.query_flag.value = False
-                    
-                    if bsave: # flag that this frame was added to queue during a saving period
-
-                        # add new data to in-memory buffer
-                        x,y = self.resolution[di]
-                        _saving_buf[di][_buf_idx[di]] = temp.reshape([y,x])
-                        _saving_ts_buf[di][_buf_idx[di]] = ts
-                        _buf_idx[di] += 1
-                        # if necessary, flush out buffer to hdf dataset
-                        if (self.flushing.value and _buf_idx[di]>=self.min_flush) or _buf_idx[di] >= self.buffer_size:
-                            if _buf_idx[di] >= self.buffer_size:
-                                logging.warning('Dumping camera b/c reached max buffer (buffer={}, current idx={})'.format(self.buffer_size, _buf_idx[di]))
-                            self.vw[di][_sav_idx[di]:_sav_idx[di]+_buf_idx[di],:,:] = _saving_buf[di][:_buf_idx[di]]
-                            self.vwts[di][_sav_idx[di]:_sav_idx[di]+_buf_idx[di],:] = _saving_ts_buf[di][:_buf_idx[di]]
-                            _sav_idx[di] += _buf_idx[di]
-                            _buf_idx[di] = 0
-  
-                        
-            # final flush:
-            for di in range(self.n_cams):
-                self.vw[di][_sav_idx[di]:_sav_idx[di]+_buf_idx[di],:,:] = _saving_buf[di][:_buf_idx[di]]
-                self.vwts[di][_sav_idx[di]:_sav_idx[di]+_buf_idx[di]] = _saving_ts_buf[di][:_buf_idx[di]]
-                _sav_idx[di] += _buf_idx[di]
-                # cut off all unused allocated space 
-                self.vw[di].resize([_sav_idx[di],self.vw[di].shape[1],self.vw[di].shape[2]])
-                self.vwts[di].resize([_sav_idx[di],2])
+                    self.stats.save(self.vw_f, di)
 
             self.vw_f.close()
             
-            self.saving_complete.value = True
+            self.saving_complete.set()
+
+        def _write(self, di):
+            # Writer thread for camera di: reads frames from its ring until it is empty and the kill flag has been raised
+            fs = self.frame_shapes[di]
+            ring = self.frame_buffer[di]
+            query_start = int(np.sum([np.product(s) for s in self.frame_shapes[:di]]))
+            chunk = np.zeros((self.chunk_frames,)+fs, dtype=np.uint8) # chunk being filled
+            chunk_ts = np.empty((self.chunk_frames,2), dtype=np.float64)
+            _chunk_idx = 0 # frames in chunk
+            pending = [] # (compressed chunk, its filter mask, its timestamps), awaiting a flush
+            _n_pending = 0 # frames in pending
+            _sav_idx = 0 # index within hdf5 dataset
+            killed = False
+
+            while True:
+                # Get new frame from ring; temp is a view of the frame's slot, read in place until released
+                ts=temp=bsave=None
+                try:
+                    ts,temp,bsave = ring.get(timeout=0.1)
+                except Queue.Empty:
+                    if self.kill_flag.value:
+                        break
+
+                if ts is not None:
+                    if self.kill_flag.value and not killed:
+                        logging.info('Final flush for camera {}: {} frames remain.'.format(di, ring.qsize()+1))
+                        killed = True
+
+                    if self.query_flag[di]:
+                        mp2np(self.query_queue)[query_start:query_start+temp.size] = temp
+                        self.query_flag[di] = False
+
+                    if self.stats is not None:
+                        self.stats.taken(di, bsave, ring.qsize()-1)
+
+                    if bsave: # flag that this frame was added to ring during a saving period
+                        chunk[_chunk_idx] = temp.reshape(fs)
+                        chunk_ts[_chunk_idx] = ts
+                        _chunk_idx += 1
+                    ring.release()
+
+                    if _chunk_idx == self.chunk_frames:
+                        pending.append(self._codec.compress(chunk) + (chunk_ts.copy(),))
+                        _n_pending += _chunk_idx
+                        _chunk_idx = 0
+
+                # if necessary, flush out pending chunks to hdf dataset
+                if (self.flushing.value and _n_pending>=self.min_flush) or _n_pending >= self.buffer_size:
+                    if _n_pending >= self.buffer_size:
+                        logging.warning('Dumping camera b/c reached max buffer (buffer={}, current idx={})'.format(self.buffer_size, _n_pending))
+                    _sav_idx = self._flush(di, pending, _sav_idx)
+                    pending,_n_pending = [],0
+
+            # final flush, including the last, partial chunk (padded: the dataset is cut to the frames saved)
+            if _chunk_idx:
+                chunk[_chunk_idx:] = 0
+                pending.append(self._codec.compress(chunk) + (chunk_ts[:_chunk_idx].copy(),))
+            _sav_idx = self._flush(di, pending, _sav_idx)
+            with self._lock:
+                # cut off all unused allocated space 
+                self.vw[di].resize(_sav_idx, axis=0)
+                self.vwts[di].resize(_sav_idx, axis=0)
+
+        def _flush(self, di, pending, _sav_idx):
+            # Writes pending chunks of camera di from frame _sav_idx (a multiple of chunk_frames) on, extending its datasets if there is not enough room; returns the new _sav_idx
+            n = _sav_idx + sum(len(cts) for _,_,cts in pending)
+            with self._lock:
+                if self.vw[di].shape[0] < n:
+                    assert self.vw[di].shape[0] == self.vwts[di].shape[0], 'Frame and timestamp dataset lengths are mismatched.'
+                    size = n + self.hdf_resize
+                    self.vw[di].resize(size, axis=0)
+                    self.vwts[di].resize(size, axis=0)
+                for data,mask,cts in pending:
+                    self.vw[di].id.write_direct_chunk((_sav_idx,)+(0,)*len(self.frame_shapes[di]), data, mask)
+                    self.vwts[di][_sav_idx:_sav_idx+len(cts)] = cts
+                    _sav_idx += len(cts)
+                    if self.stats is not None:
+                        self.stats.written(di, cts[:,1])
+            return _sav_idx
     
     class PSEye():
         """
         Handles two distinct objects: the PSEye acqusition object, and the PSEye saving object, which run in separate processes
         """
-        def __init__(self, idx, resolution_mode, frame_rate, color_mode, query_rate=1, save_name='noname', cleye_params=None, sync_flag=None):
+        def __init__(self, idx, resolution_mode, frame_rate, color_mode, query_rate=1, save_name='noname', cleye_params=None, sync_flag=None, ring_slots=256, codec='gzip:1'):
 
             # CLEye Params; all should be tuples to allow for multiple cameras
             self.idx                = idx
@@ -195,6 +227,8 @@ elif not TESTING_MODE:
             # Interfacing params
             self.query_rate         = query_rate
             self.save_name          = save_name
+            self.ring_slots         = ring_slots # frames per camera held in shared memory between acquisition and saving
+            self.codec              = codec # see video_codecs
 
             # Special case for scenario where user uses shortcut for single camera, supplying straight params instead of n-length tuples
             if isinstance(self.idx, int):
@@ -210,15 +244,19 @@ elif not TESTING_MODE:
 
             # Inferred params
             self.resolution = [_PSEye.DIMENSIONS[rm] for rm in self.resolution_mode]
+            self.frame_shapes = [tuple(r[::-1]) + ((_PSEye.BYTES_PER_PIXEL[cm],) if cm == _PSEye.COLOUR else ()) for r,cm in zip(self.resolution,self.color_mode)]
+            self.frame_bytes = [np.product(fs) for fs in self.frame_shapes]
 
             # Shared variables for acqusition and saving processes
-            self.frame_buffer = [mp.Queue() for _ in range(self.n_cams)]
-            self.kill_flag = mp.Value('b',False)
+            self.frame_buffer = [FrameRing(fb, n_slots=self.ring_slots) for fb in self.frame_bytes]
+            self.stats = CameraStats(self.n_cams, self.frame_rate)
+            self.kill_flag = mp.Value('b',False) # stops acquisition
+            self.save_kill_flag = mp.Value('b',False) # stops saving, once acquisition has stopped and the rings are empty
             self.saving = mp.Value('b', False)
             self.flushing = mp.Value('b', False)
 
-            self.saver = MovieSaver(name=self.save_name, resolution=self.resolution, kill_flag=self.kill_flag, frame_buffer=self.frame_buffer, flushing=self.flushing, n_cams=self.n_cams)
-            self.pseye = _PSEye(idx=self.idx, resolution_mode=self.resolution_mode, frame_rate=self.frame_rate, color_mode=self.color_mode, frame_buffer=self.frame_buffer, kill_flag=self.kill_flag, saving_flag=self.saving, sync_flag=sync_flag, cleye_params=self.cleye_params)
+            self.saver = MovieSaver(name=self.save_name, resolution=self.resolution, frame_shapes=self.frame_shapes, codec=self.codec, stats=self.stats, kill_flag=self.save_kill_flag, frame_buffer=self.frame_buffer, flushing=self.flushing, n_cams=self.n_cams)
+            self.pseye = _PSEye(idx=self.idx, resolution_mode=self.resolution_mode, frame_rate=self.frame_rate, color_mode=self.color_mode, frame_buffer=self.frame_buffer, stats=self.stats, kill_flag=self.kill_flag, saving_flag=self.saving, sync_flag=sync_flag, cleye_params=self.cleye_params)
 
             self.last_query = now()            
 
@@ -226,31 +264,48 @@ elif not TESTING_MODE:
             if now()-self.last_query < 1./self.query_rate:
                 return None
             self.last_query = now()
-            self.saver.query_flag.value = True
+            self.saver.query_flag[:] = [True]*self.n_cams
             frs = []
             idx = 0
             full = mp2np(self.saver.query_queue)
-            for r in self.resolution:
-                nl = np.product(r)
-                fr = full[idx:idx+nl].reshape(r[::-1])
+            for fs in self.frame_shapes:
+                nl = np.product(fs)
+                fr = full[idx:idx+nl].reshape(fs)
                 idx += nl
                 frs.append(fr)
             return frs
         
+        def get_stats(self):
+            # frame accounting of each camera, as a list of dicts (see camera_stats)
+            return [self.stats.get(i) for i in range(self.n_cams)]
+
         def reset_cams(self):
             self.pseye.reset_cams()
 
-        def end(self):
-            self.kill_flag.value = True
-            while (not self.pseye.thread_complete.value) or (not self.saver.saving_complete.value):
-                pass
+        def end(self, timeout=1.):
+            # stop acquisition, then saving once the saver has emptied the rings, waiting for each process to finish, checking every timeout secs that it is still alive
+            for proc,kill,done in [(self.pseye, self.kill_flag, self.pseye.thread_complete), (self.saver, self.save_kill_flag, self.saver.saving_complete)]:
+                kill.value = True
+                if proc is self.pseye:
+                    self.pseye.wake.set()
+                while not done.wait(timeout):
+                    if not proc.is_alive():
+                        logging.error('{} exited (code {}) without completing.'.format(type(proc).__name__, proc.exitcode))
+                        break
+
+            for i,st in enumerate(self.get_stats()):
+                msg = 'Camera {}: {} of {} frames acquired while saving were written ({} dropped by the ring, {} skipped by the camera).'.format(i, st['written'], st['acquired_saving'], st['dropped_saving'], st['skipped'])
+                if st['missing'] or st['skipped']:
+                    logging.warning(msg)
+                else:
+                    logging.info(msg)
         def begin_saving(self):
             self.saving.value = True
             
     class _PSEye(mp.Process):
         """
         An object that runs as its own process, serving the role of containing and calling the PSEye driver API
-        Constantly checks for the presence of new frames and dumps them into multiprocessing queue
+        Constantly checks for the presence of new frames and has the driver write them straight into each camera's shared-memory frame ring
         """
 
         RES_SMALL = CLEYE_CODES['qvga']
@@ -261,7 +316,7 @@ elif not TESTING_MODE:
         GREYSCALE = CLEYE_CODES['greyscale']
         BYTES_PER_PIXEL = {COLOUR:4, GREYSCALE:1}
 
-        def __init__(self, idx, resolution_mode, frame_rate, color_mode, sync_flag=None, frame_buffer=None, kill_flag=None, saving_flag=None, cleye_params={}):
+        def __init__(self, idx, resolution_mode, frame_rate, color_mode, sync_flag=None, frame_buffer=None, stats=None, kill_flag=None, saving_flag=None, cleye_params={}):
 
             # Process init
             super(_PSEye, self).__init__()
@@ -278,19 +333,21 @@ elif not TESTING_MODE:
             self.n_cams = len(self.idx)
             self.resolution = [self.DIMENSIONS[rm] for rm in self.resolution_mode]
             self.bytes_per_pixel = [self.BYTES_PER_PIXEL[cm] for cm in self.color_mode]
-            self.read_dims = [r[::-1] for r in self.resolution]
+            self.read_dims = [list(r[::-1]) for r in self.resolution]
             for i,cm in enumerate(self.color_mode):
                 if cm == self.COLOUR:
                     self.read_dims[i].append(4)
             
             # Cross-process structures inherited from parent
             self.frame_buffer = frame_buffer
+            self.stats = stats
             self.kill_flag = kill_flag
             self.saving_flag = saving_flag
 
             # Runtime flags
-            self.thread_complete = mp.Value('b',False)
+            self.thread_complete = mp.Event()
             self.reset_cams_flag = mp.Value('b', False)
+            self.wake = mp.Event() # set to wake the main loop up, on a kill or reset request
 
             # Sync
             self.sync_flag = sync_flag
@@ -300,15 +357,23 @@ elif not TESTING_MODE:
         
         def cam_callback(self, idx, timeout=2000):
             while not self.kill_callbacks:
-                if self.callbacks_paused[idx]:
+                # cameras are being reset
+                if not self._cams_ready.wait(0.5):
                     continue
-                got = self.dll.CLEyeCameraGetFrame(self._cams[idx], self._bufs[idx], timeout)
-                if got: # this is actually useless, since API apparently returns strange values even in failed cases
-                    ts,ts2 = now(),now2()
-                    fr = np.frombuffer(self._bufs[idx], dtype=np.uint8).copy()
-                    self.frame_buffer[idx].put([[ts,ts2],fr,self.saving_flag.value])
-                    #print('Frame buffer {} size: {}'.format(idx,self.frame_buffer[idx].qsize()))
-            self.callbacks_running[idx] = False
+                with self._cam_locks[idx]: # held while the driver reads a frame, so that a reset waits for it
+                    # the frame goes straight into the next free slot of the ring, or, if the saver has fallen behind and the ring is full, into a scratch buffer to be dropped
+                    addr = self.frame_buffer[idx].slot_address()
+                    got = self.dll.CLEyeCameraGetFrame(self._cams[idx], ctypes.addressof(self._bufs[idx]) if addr is None else addr, timeout)
+                    if got: # this is actually useless, since API apparently returns strange values even in failed cases
+                        ts,ts2 = now(),now2()
+                        saving = self.saving_flag.value
+                        if addr is None:
+                            self.frame_buffer[idx].drop()
+                        else:
+                            self.frame_buffer[idx].publish(ts, ts2, saving)
+                        if self.stats is not None:
+                            self.stats.acquired(idx, ts, addr is not None, saving)
+                        #print('Frame buffer {} size: {}'.format(idx,self.frame_buffer[idx].qsize()))
         
         def run(self):
             
@@ -320,24 +385,29 @@ elif not TESTING_MODE:
             # Initialize camera
             self._init_cam()
             
-            # setup buffers
+            # setup scratch buffers, for frames that do not fit in the rings
             self._bufs = [ ctypes.create_string_buffer(np.product(res) * bpp) for res,bpp in zip(self.resolution,self.bytes_per_pixel) ]
            
             # setup callback-related variables
             self.kill_callbacks = False
-            self.callbacks_running = [True for i in range(self.n_cams)]
-            self.callbacks_paused = [False for i in range(self.n_cams)]
+            self._cams_ready = threading.Event() # cleared while cameras are being reset
+            self._cams_ready.set()
+            self._cam_locks = [threading.Lock() for i in range(self.n_cams)]
            
             # begin reading threads
-            for i in range(self.n_cams):
-                threading.Thread(target=self.cam_callback, args=(i,)).start()
+            callbacks = [threading.Thread(target=self.cam_callback, args=(i,)) for i in range(self.n_cams)]
+            for c in callbacks:
+                c.start()
            
-            # Main loop
-            while any(self.callbacks_running):
-                if self.kill_flag.value:
-                    self.kill_callbacks = True
+            # Main loop: sleeps until woken by a kill or reset request (the timeout only guards against a kill flag raised without waking it)
+            while not self.kill_flag.value:
+                self.wake.wait(1.)
+                self.wake.clear()
                 if self.reset_cams_flag.value:
                     self._reset_cams()
+            self.kill_callbacks = True
+            for c in callbacks:
+                c.join()
                         
             try:
                 for c in self._cams:
@@ -346,29 +416,32 @@ elif not TESTING_MODE:
             except:
                 pass
 
-            self.thread_complete.value = 1
+            self.thread_complete.set()
 
         def reset_cams(self):
             # for calls made from other processes
             self.reset_cams_flag.value = True
+            self.wake.set()
             logging.info('Resetting cameras...')
         def _reset_cams(self):
             # for the process itself
             
-            for i in range(len(self.callbacks_paused)):
-                self.callbacks_paused[i] = True
-                
+            self._cams_ready.clear()
+            for l in self._cam_locks:
+                l.acquire() # waits for frames being read
             try:
-                for c in self._cams:
-                    self.dll.CLEyeCameraStop(c)
-                    self.dll.CLEyeDestroyCamera(c)
-            except:
-                pass
-            
-            self._init_cam()
-
-            for i in range(len(self.callbacks_paused)):
-                self.callbacks_paused[i] = False
+                try:
+                    for c in self._cams:
+                        self.dll.CLEyeCameraStop(c)
+                        self.dll.CLEyeDestroyCamera(c)
+                except:
+                    pass
+                
+                self._init_cam()
+                self._cams_ready.set()
+            finally:
+                for l in self._cam_locks:
+                    l.release()
             
             self.reset_cams_flag.value = False
             logging.info('Cameras reset.')
@@ -377,7 +450,7 @@ elif not TESTING_MODE:
             # Load dynamic library
             self.dll = ctypes.cdll.LoadLibrary(self.lib)
             self.dll.CLEyeGetCameraUUID.restype = GUID
-            self.dll.CLEyeCameraGetFrame.argtypes = [c_void_p, c_char_p, c_int]
+            self.dll.CLEyeCameraGetFrame.argtypes = [c_void_p, c_void_p, c_int]
             self.dll.CLEyeCreateCamera.argtypes = [GUID, c_int, c_int, c_float]
         
             n_cams_available = self.dll.CLEyeGetCameraCount()
@@ -412,6 +485,7 @@ elif not TESTING_MODE:
                                 resolution_mode=(_PSEye.RES_SMALL,_PSEye.RES_SMALL), 
                                 query_rate = 0.5,
                                 frame_rate=(30,30), 
+                                codec = 'gzip:1',
                                 color_mode=(_PSEye.GREYSCALE,_PSEye.GREYSCALE),
                                 cleye_params = ( dict(
                                                        auto_gain = False,
@@ -10,6 +10,7 @@ elif not TESTING_MODE:
     import multiprocessing as mp
     import warnings, threading, logging, copy
     from util import now,now2
+    from ring_buffer import ReadRing
 
     class List(list):
         pass
@@ -95,9 +96,10 @@ elif not TESTING_MODE:
     class DAQIn(pydaq.Task):
         """
         From the perspective of the code instantiating the DAQIn class, expect the following:
-        It will constantly read in data, adding to the data_q. that's it
+        It will constantly read in data, into the slots of ring (a ReadRing). that's it
+        quantise : (scale, offset) to store reads as int16 counts, volts = counts*scale + offset
         """
-        def __init__(self, device='Dev1', ports=['ao0'], read_buffer_size=10, timeout=5., sample_rate=400., AI_mode=pydaq.DAQmx_Val_Diff, save_buffer_size=8000, analog_minmax=(-10,10)):
+        def __init__(self, device='Dev1', ports=['ao0'], read_buffer_size=10, timeout=5., sample_rate=400., AI_mode=pydaq.DAQmx_Val_Diff, save_buffer_size=8000, analog_minmax=(-10,10), quantise=None, ring_slots=256):
             
             # DAQ properties
             pydaq.Task.__init__(self)
@@ -113,9 +115,10 @@ elif not TESTING_MODE:
             self.read_success = pydaq.int32()
             self.read_buffer_size = read_buffer_size
             self.effective_buffer_size = self.read_buffer_size * len(self.ports)
-            self.read_data = np.zeros(self.effective_buffer_size) # memory for DAQmx to write into on read callbacks
+            self.read_data = np.zeros(self.effective_buffer_size) # memory for DAQmx to write into on read callbacks that cannot go straight into the ring
+            self.quantise = quantise
             self.last_ts = None
-            self.data_q = mp.Queue()
+            self.ring = ReadRing(self.effective_buffer_size, n_slots=ring_slots, dtype=np.float64 if self.quantise is None else np.int16)
 
             # Setup task
             try:
@@ -130,15 +133,22 @@ elif not TESTING_MODE:
                 raise
 
         def EveryNCallback(self):
-            # Auto-triggered by daqmx, adds new data to data queue
+            # Auto-triggered by daqmx, reads new data into the next slot of the ring
 
             self.last_ts = now()
             self.last_ts2 = now2()
-            self.ReadAnalogF64(self.read_buffer_size, self.timeout, pydaq.DAQmx_Val_GroupByChannel, self.read_data, self.effective_buffer_size, pydaq.byref(self.read_success), None)
-            if self.read_success:
-                self.data_q.put([self.last_ts, self.last_ts2, self.read_data.copy()])
-            else:
+            slot = self.ring.slot()
+            into = slot if (slot is not None and self.quantise is None) else self.read_data # the read must happen even if the ring is full, to keep the DAQ's buffer from overflowing
+            self.ReadAnalogF64(self.read_buffer_size, self.timeout, pydaq.DAQmx_Val_GroupByChannel, into, self.effective_buffer_size, pydaq.byref(self.read_success), None)
+            if not self.read_success:
                 warnings.warn('Failed to read despite callback having initiated read')
+            elif slot is None:
+                self.ring.drop()
+            else:
+                if self.quantise is not None:
+                    scale,offset = self.quantise
+                    slot[:] = np.clip(np.rint((self.read_data-offset)/scale), -32768, 32767)
+                self.ring.publish(self.last_ts, self.last_ts2)
             
             return 0
 
@@ -1,5 +1,6 @@
 import numpy as np
-from util import now
+from util import now, now2
+from ring_buffer import ReadRing
 import multiprocessing as mp
 import threading
 
@@ -14,27 +15,42 @@ class SICommunicator():
 class DAQIn(object):
     ANALOG_IN,ANALOG_OUT,DIGITAL_IN,DIGITAL_OUT = 0,0,0,0
     sample_rate = 0
-    def __init__(self,*args,**kwargs):
-        self.t0 = now()
-        self.sample_rate = 40
-        self.data_q = mp.Queue()
+    def __init__(self, ports=['ai0','ai1','ai2','ai3','ai4'], read_buffer_size=10, sample_rate=400., quantise=None, ring_slots=256, **kwargs):
+        self.ports = ports
+        self.read_buffer_size = read_buffer_size
+        self.sample_rate = sample_rate
+        self.quantise = quantise
+        self.ring = ReadRing(len(self.ports)*self.read_buffer_size, n_slots=ring_slots, dtype=np.float64 if self.quantise is None else np.int16)
         self.on = True
+        self._stop = threading.Event() # set by release, to end the wait for the next read
         threading.Thread(target=self.go).start()
     def go(self):
+        # one read of read_buffer_size samples every read_buffer_size/sample_rate secs, into the ring like DAQIn.EveryNCallback
+        interval = float(self.read_buffer_size)/self.sample_rate
+        t_next = now() + interval
         while self.on:
-            while now()-self.t0 < 1./self.sample_rate:
-                pass
-            self.t0 = now()
-            dat = (0.1*np.arange(50)).reshape([5,10]).astype(float)+np.random.normal(0,.5,size=[5,10])
+            if self._stop.wait(max(0., t_next-now())):
+                break
+            t_next += interval
+            dat = (0.1*np.arange(len(self.ports)*self.read_buffer_size)).reshape([len(self.ports),self.read_buffer_size]).astype(float)+np.random.normal(0,.5,size=[len(self.ports),self.read_buffer_size])
             if np.random.random()<0.15:
                 dat[0,:] = np.random.choice([4,5,6,7,8])
             if np.random.random()<0.15:
                 dat[1,:] = np.random.choice([4,5,6,7,8])
-            self.data_q.put( [now(), now(), dat] ) 
+            ts,ts2 = now(),now2()
+            slot = self.ring.slot()
+            if slot is None:
+                self.ring.drop()
+                continue
+            if self.quantise is not None:
+                dat = np.clip(np.rint((dat-self.quantise[1])/self.quantise[0]), -32768, 32767)
+            slot[:] = dat.ravel()
+            self.ring.publish(ts, ts2)
     def trigger(self, *args, **kwargs):
         pass
     def release(self):
         self.on = False
+        self._stop.set()
 
 class DAQOut(object):
     ANALOG_IN,ANALOG_OUT,DIGITAL_IN,DIGITAL_OUT = 0,0,0,0
@@ -77,5 +93,7 @@ class PSEye(object):
         pass
     def get(self):
         return (255*np.random.random([320,240])).astype(np.uint8)
+    def get_stats(self):
+        return None
 
 default_cam_params = dict()
@@ -0,0 +1,98 @@
+"""
+Online features for the AnalogReader: on every read, each feature updates its causal state from its channel's new samples and returns its outputs, which the AnalogReader publishes (see AnalogReader.get_features).
+Configured in ar_params['features'] as dicts of kind (a key of FEATURES), name, channel and the feature's parameters, e.g. dict(kind='pulses', name='puffl', channel='puffl', thresh=2.)
+"""
+import numpy as np
+from scipy.signal import butter, lfilter, lfilter_zi
+
+class Feature(object):
+    OUTPUTS = [] # output names, each prefixed by the feature's name as name_output ('' gives just name)
+
+    def __init__(self, name, channel, sample_rate):
+        self.name = name
+        self.channel = channel
+        self.sample_rate = sample_rate
+
+    @property
+    def output_names(self):
+        return ['_'.join([self.name,o]) if o else self.name for o in self.OUTPUTS]
+
+    def process(self, x, t):
+        # x: new samples of the channel, t: their timestamps; returns a list of output values, one per OUTPUTS
+        raise NotImplementedError
+
+class LowPass(Feature):
+    # Causal Butterworth low-pass filter; output is the latest filtered value
+    OUTPUTS = ['']
+
+    def __init__(self, name, channel, sample_rate, cutoff=10., order=2):
+        super(LowPass, self).__init__(name, channel, sample_rate)
+        self.b,self.a = butter(order, cutoff/(sample_rate/2.))
+        self.zi = None # filter state, initialised from the first sample to avoid a startup transient
+
+    def filter(self, x):
+        if self.zi is None:
+            self.zi = lfilter_zi(self.b, self.a) * x[0]
+        y,self.zi = lfilter(self.b, self.a, x, zi=self.zi)
+        return y
+
+    def process(self, x, t):
+        return [self.filter(x)[-1]]
+
+def rising_edges(x, t, thresh, above, lockout_until, min_interval):
+    """
+    Upward crossings of thresh in x (after lockout_until, and min_interval apart), as (their timestamps, whether x ends above thresh, updated lockout_until)
+    """
+    ab = x >= thresh
+    edges = np.flatnonzero(ab & ~np.concatenate([[above], ab[:-1]]))
+    times = []
+    for e in edges:
+        if t[e] >= lockout_until:
+            times.append(t[e])
+            lockout_until = t[e] + min_interval
+    return times, ab[-1], lockout_until
+
+class Pulses(Feature):
+    # Pulse detector, e.g. for puff monitors; outputs the number of pulses so far and the timestamp of the latest
+    OUTPUTS = ['count','last']
+
+    def __init__(self, name, channel, sample_rate, thresh=2., min_interval=0.):
+        super(Pulses, self).__init__(name, channel, sample_rate)
+        self.thresh = thresh
+        self.min_interval = min_interval # secs: pulses closer together than this count once
+        self.count = 0
+        self.last = np.nan
+        self._above = False
+        self._lockout = -np.inf
+
+    def process(self, x, t):
+        times,self._above,self._lockout = rising_edges(x, t, self.thresh, self._above, self._lockout, self.min_interval)
+        if times:
+            self.count += len(times)
+            self.last = times[-1]
+        return [self.count, self.last]
+
+class Speed(Feature):
+    # Running speed from a wheel sensor that pulses as the wheel turns: pulses per sec over the last window secs, times scale (e.g. distance per pulse)
+    OUTPUTS = ['']
+
+    def __init__(self, name, channel, sample_rate, thresh=2.5, window=1., scale=1., cutoff=None):
+        super(Speed, self).__init__(name, channel, sample_rate)
+        self.thresh = thresh
+        self.window = window
+        self.scale = scale
+        self.lowpass = LowPass(name, channel, sample_rate, cutoff=cutoff) if cutoff else None # optional smoothing before pulse detection
+        self._pulses = np.array([])
+        self._above = False
+
+    def process(self, x, t):
+        if self.lowpass is not None:
+            x = self.lowpass.filter(x)
+        times,self._above,_ = rising_edges(x, t, self.thresh, self._above, -np.inf, 0.)
+        self._pulses = np.append(self._pulses[self._pulses > t[-1]-self.window], times)
+        return [self.scale * len(self._pulses) / self.window]
+
+FEATURES = dict(lowpass=LowPass, pulses=Pulses, speed=Speed)
+
+def make_feature(kind, name, channel, sample_rate, **kwargs):
+    return FEATURES[kind](name, channel, sample_rate, **kwargs)
@@ -0,0 +1,185 @@
+import ctypes, time, Queue
+import multiprocessing as mp
+import numpy as np
+
+class RingBuffer(object):
+    """
+    Fixed-size (channels x samples) buffer with a contiguous view of its most recent n samples
+    Every sample is written twice, into an array of twice the size, so that writes cost O(block size) and reads need no copy
+    """
+    def __init__(self, n_channels, size, dtype=np.float64):
+        self.size = size
+        self.buf = np.zeros([n_channels, 2*size], dtype=dtype)
+        self.i = 0 # position of the next sample to be written, in [0,size)
+        self.n_written = 0 # total samples ever written
+
+    def write(self, data):
+        # data: (channels x n) array, or a scalar per channel as (channels x 1), n <= size
+        n = data.shape[-1]
+        i,size = self.i,self.size
+        k = min(n, size-i) # samples that fit before the end of the first half
+        self.buf[:, i:i+k] = data[:, :k]
+        self.buf[:, i+size:i+size+k] = data[:, :k]
+        if k < n:
+            self.buf[:, :n-k] = data[:, k:]
+            self.buf[:, size:size+n-k] = data[:, k:]
+        self.i = (i+n) % size
+        self.n_written += n
+
+    def last(self, n):
+        # View of the most recent n samples (at most size), oldest first; not a copy, so it changes with subsequent writes
+        n = min(n, self.size)
+        end = self.i + self.size
+        return self.buf[:, end-n:end]
+
+class SeqlockRing(object):
+    """
+    Ring of samples in shared memory, with one writing process, any number of readers, and no lock
+    The writer increments a sequence counter before and after each write; readers retry until they copy the ring with the counter even and unchanged
+    """
+    def __init__(self, n_channels, size):
+        self.n_channels = n_channels
+        self.size = size
+        self._buf = mp.RawArray('d', size*n_channels)
+        self._seq = mp.RawValue(ctypes.c_ulonglong, 0)
+        self._n_written = mp.RawValue(ctypes.c_ulonglong, 0)
+
+    def _view(self):
+        return np.frombuffer(self._buf).reshape([self.size, self.n_channels])
+
+    def write(self, data):
+        # data: (channels x n) array of new samples, n <= size
+        n = data.shape[-1]
+        buf = self._view()
+        i = self._n_written.value % self.size
+        k = min(n, self.size-i)
+        self._seq.value += 1
+        buf[i:i+k] = data[:, :k].T
+        if k < n:
+            buf[:n-k] = data[:, k:].T
+        self._n_written.value += n
+        self._seq.value += 1
+
+    def read(self, timeout=1.):
+        # Returns a consistent copy of the ring as (channels x size), oldest sample first
+        buf = self._view()
+        t0 = time.time()
+        while time.time()-t0 < timeout:
+            seq = self._seq.value
+            if seq % 2:
+                time.sleep(0) # writer is mid-write: yield to it
+                continue
+            snap = buf.copy()
+            i = self._n_written.value % self.size
+            if self._seq.value == seq:
+                return np.concatenate([snap[i:], snap[:i]]).T
+        raise Exception('No consistent snapshot of ring within {} s: its writer may have died mid-write.'.format(timeout))
+
+class ReadRing(object):
+    """
+    Preallocated ring of DAQ reads, which the driver's callback fills in place for a consumer thread in the same process
+    Single producer, single consumer; once the consumer is n_slots reads behind, reads are dropped and counted
+    """
+    def __init__(self, n_values, n_slots=256, dtype=np.float64):
+        self.n_slots = n_slots
+        self.data = np.zeros([n_slots, n_values], dtype=dtype)
+        self.ts = np.zeros([n_slots, 2])
+        self.seq = np.zeros(n_slots, dtype=np.int64)
+        self.n_written = 0 # slots published, producer side only
+        self.n_read = 0 # slots freed, consumer side only
+        self.n_reads = 0 # reads acquired, dropped ones included
+        self.n_dropped = 0
+        self._ready = mp.Semaphore(0)
+
+    def slot(self):
+        # Producer: the slot to fill with the next read, or None if the ring is full
+        if self.n_written - self.n_read >= self.n_slots:
+            return None
+        return self.data[self.n_written % self.n_slots]
+
+    def publish(self, ts, ts2):
+        # Producer: makes the slot just filled available to the consumer, with the read's timestamps
+        i = self.n_written % self.n_slots
+        self.ts[i] = ts, ts2
+        self.seq[i] = self.n_reads
+        self.n_reads += 1
+        self.n_written += 1
+        self._ready.release()
+
+    def drop(self):
+        # Producer: records a read that did not fit
+        self.n_reads += 1
+        self.n_dropped += 1
+
+    def get(self, timeout=None):
+        # Consumer: (seq, ts, ts2, data) of the oldest unread read, data being a view of its slot, valid until release(); raises Queue.Empty after timeout secs
+        if not self._ready.acquire(True, timeout):
+            raise Queue.Empty
+        i = self.n_read % self.n_slots
+        return self.seq[i], self.ts[i,0], self.ts[i,1], self.data[i]
+
+    def release(self):
+        # Consumer: frees the slot returned by the last get()
+        self.n_read += 1
+
+    def qsize(self):
+        return self.n_written - self.n_read
+
+class FrameRing(object):
+    """
+    Shared-memory ring of camera frames, which the driver writes in place for the MovieSaver process to read, as in ReadRing
+    """
+    def __init__(self, frame_bytes, n_slots=256):
+        self.frame_bytes = frame_bytes
+        self.n_slots = n_slots
+        self._data = mp.RawArray(ctypes.c_uint8, frame_bytes*n_slots)
+        self._ts = mp.RawArray('d', 2*n_slots)
+        self._saving = mp.RawArray(ctypes.c_bool, n_slots)
+        self._n_written = mp.RawValue(ctypes.c_ulonglong, 0) # slots published, written by the producer only
+        self._n_read = mp.RawValue(ctypes.c_ulonglong, 0) # slots freed, written by the consumer only
+        self._n_dropped = mp.RawValue(ctypes.c_ulonglong, 0)
+        self._ready = mp.Semaphore(0)
+
+    def slot_address(self):
+        # Producer: address of the slot to fill with the next frame, for the driver to write into, or None if the ring is full
+        n = self._n_written.value
+        if n - self._n_read.value >= self.n_slots:
+            return None
+        return ctypes.addressof(self._data) + (n % self.n_slots)*self.frame_bytes
+
+    def publish(self, ts, ts2, saving):
+        # Producer: makes the slot just filled available to the consumer
+        n = self._n_written.value
+        i = n % self.n_slots
+        self._ts[2*i] = ts
+        self._ts[2*i+1] = ts2
+        self._saving[i] = saving
+        self._n_written.value = n + 1
+        self._ready.release()
+
+    def drop(self):
+        # Producer: records a frame that did not fit
+        self._n_dropped.value += 1
+
+    def get(self, block=True, timeout=None):
+        # Consumer: ([ts, ts2], frame, saving) of the oldest unread frame, frame being a flat uint8 view of its slot, valid until release(); raises Queue.Empty if there is none (after timeout secs, if blocking)
+        if not self._ready.acquire(block, timeout):
+            raise Queue.Empty
+        i = self._n_read.value % self.n_slots
+        fr = np.frombuffer(self._data, dtype=np.uint8, count=self.frame_bytes, offset=i*self.frame_bytes)
+        return [self._ts[2*i], self._ts[2*i+1]], fr, self._saving[i]
+
+    def release(self):
+        # Consumer: frees the slot returned by the last get()
+        self._n_read.value += 1
+
+    def qsize(self):
+        return self._n_written.value - self._n_read.value
+
+    @property
+    def n_written(self):
+        return self._n_written.value
+
+    @property
+    def n_dropped(self):
+        return self._n_dropped.value
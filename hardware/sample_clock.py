@@ -0,0 +1,58 @@
+"""
+Sample clock: the time of any sample, from a linear fit of the reads' stamps against sample index, which averages out the jitter of the DAQ callback.
+Samples are saved to the analog table indexed by sample, with one row per read in analog_blocks (its last sample, with its now() stamp as index and now2() as ts_global), from which sample_times gives sample times after the fact.
+"""
+import numpy as np
+
+class SampleClock(object):
+    """
+    Running linear fit of host time (now() and now2()) against sample index, exponentially weighted over the last ~window reads
+    """
+    def __init__(self, sample_rate, window=1000):
+        self.sample_rate = sample_rate
+        self.decay = 1. - 1./window
+        self.origin = None # (ts, ts2) of the first read: times are fit relative to it, for precision
+        self._w = 0. # total weight
+        self._mx = 0. # weighted mean of sample index
+        self._my = np.zeros(2) # weighted mean of (ts, ts2), relative to origin
+        self._cxx = 0. # weighted (co)variances
+        self._cxy = np.zeros(2)
+
+    def update(self, sample, ts, ts2):
+        # Adds a read whose last sample, of index sample, was stamped (ts, ts2)
+        if self.origin is None:
+            self.origin = np.array([ts, ts2])
+        y = np.array([ts, ts2]) - self.origin
+        self._w = self.decay*self._w + 1.
+        a = 1./self._w
+        dx = sample - self._mx
+        self._mx += a*dx
+        self._my += a*(y-self._my)
+        self._cxx = self.decay*self._cxx + dx*(sample-self._mx)
+        self._cxy = self.decay*self._cxy + dx*(y-self._my)
+
+    def slope(self):
+        # secs per sample, for (ts, ts2); the nominal sample interval until there are enough reads to fit
+        if self._cxx <= 0:
+            return np.array([1., 1.]) / self.sample_rate
+        return self._cxy / self._cxx
+
+    def times(self, samples):
+        # (ts, ts2) of the given sample indices, as two arrays
+        x = np.asarray(samples, dtype=float) - self._mx
+        b = self.slope()
+        t0 = self.origin + self._my
+        return t0[0] + b[0]*x, t0[1] + b[1]*x
+
+def sample_times(blocks, samples, clock='ts_global'):
+    """
+    Times of the given sample indices, by a fit over one session's analog_blocks table
+    clock : 'ts_global' for now2() times, 'index' for now() times of the AnalogReader process
+    """
+    x = blocks['sample'].values.astype(float)
+    y = blocks.index.values if clock == 'index' else blocks[clock].values
+    ok = np.isfinite(y)
+    x,y = x[ok],y[ok]
+    x0,y0 = x[0],y[0]
+    b,a = np.polyfit(x-x0, y-y0, 1)
+    return y0 + a + b*(np.asarray(samples, dtype=float)-x0)
@@ -0,0 +1,169 @@
+"""
+Raw sample spill: the AnalogReader's samples written straight to a per-session memory-mapped file instead of through the saver, and converted into the analog (or analog_int16) table by convert_spills between sessions.
+A spill file is a fixed-size header (magic, sample count, json metadata) followed by samples, one row of channels each; the count is updated after every write, so a crash loses nothing written.
+To convert manually: python -m hardware.spill [spill_file_or_dir] [--keep]
+"""
+import os, sys, struct, json, glob, logging, warnings, argparse, tables
+import numpy as np
+import pandas as pd
+
+MAGIC = 'SPL1'
+HEADER_SIZE = 4096
+COUNT = struct.Struct('<Q') # at offset 8
+META_LEN = struct.Struct('<I') # at offset 16
+META_OFFSET = 20
+EXT = '.spill'
+
+def default_spill_dir(data_file):
+    return os.path.join(os.path.dirname(os.path.abspath(data_file)), 'spill')
+
+def spill_path(spill_dir, sesh_name, subj_num):
+    return os.path.join(spill_dir, '{}_{}{}'.format(sesh_name.strftime('%Y%m%d%H%M%S'), int(subj_num), EXT))
+
+class SpillWriter(object):
+    """
+    Appends (channels x n) blocks of samples to a new spill file at path, extending it by grow samples whenever it fills
+    """
+    def __init__(self, path, n_channels, dtype=np.float32, first_sample=0, grow=2**20, **meta):
+        self.path = path
+        self.n_channels = n_channels
+        self.dtype = np.dtype(dtype)
+        self.grow = grow
+        self.n = 0
+        meta = json.dumps(dict(meta, dtype=self.dtype.str, n_channels=n_channels, first_sample=int(first_sample)))
+        if META_OFFSET+len(meta) > HEADER_SIZE:
+            raise Exception('Spill metadata too long for header ({} bytes).'.format(len(meta)))
+        if not os.path.exists(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        with open(path, 'wb') as f:
+            f.write(MAGIC + '\0'*4 + COUNT.pack(0) + META_LEN.pack(len(meta)) + meta)
+            f.write('\0'*(HEADER_SIZE-f.tell()))
+        self.capacity = 0
+        self._mm = None
+        self._extend(grow)
+
+    def _unmap(self):
+        # The whole file is one mapping, header included: a file cannot be resized while mapped (on Windows)
+        self._mm.flush()
+        del self.data, self._count, self._mm
+
+    def _extend(self, n):
+        # Grows the file by n samples and remaps it
+        if self._mm is not None:
+            self._unmap()
+        self.capacity += n
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self.capacity*self.n_channels*self.dtype.itemsize)
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r+')
+        self._count = self._mm[8:16].view(np.uint64)
+        self.data = self._mm[HEADER_SIZE:].view(self.dtype).reshape([self.capacity, self.n_channels])
+
+    def write(self, data):
+        # data: (channels x n) array of new samples
+        n = data.shape[-1]
+        if self.n+n > self.capacity:
+            self._extend(max(self.grow, n))
+        self.data[self.n:self.n+n] = data.T
+        self.n += n
+        self._count[0] = self.n
+
+    def close(self):
+        # Flushes, and trims the file to the samples written
+        self._unmap()
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self.n*self.n_channels*self.dtype.itemsize)
+
+def _str_keys(d):
+    # json gives unicode, which pytables does not accept for names and options
+    return {str(k):(str(v) if isinstance(v, unicode) else v) for k,v in d.items()}
+
+def read_header(path):
+    # Returns (metadata dict, number of samples written)
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_SIZE)
+    if head[:4] != MAGIC:
+        raise Exception('{} is not a spill file.'.format(path))
+    n, = COUNT.unpack(head[8:16])
+    length, = META_LEN.unpack(head[16:20])
+    meta = json.loads(head[META_OFFSET:META_OFFSET+length], object_hook=_str_keys)
+    meta['columns'] = [str(c) for c in meta['columns']]
+    # a crash can leave the count ahead of what the file holds only if the file was never extended to it
+    n = min(n, (os.path.getsize(path)-HEADER_SIZE) // (meta['n_channels']*np.dtype(str(meta['dtype'])).itemsize))
+    return meta, n
+
+def read_spill(path, start=0, stop=None):
+    """
+    Samples [start,stop) of a spill file, as a DataFrame laid out as its rows in the analog table (float64, or int16 counts for analog_int16, indexed by sample, with session and subj columns)
+    """
+    meta,n = read_header(path)
+    dtype = np.dtype(meta['dtype'])
+    stop = n if stop is None else min(stop, n)
+    if stop > start:
+        data = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(n, meta['n_channels']))[start:stop]
+    else:
+        data = np.zeros([0, meta['n_channels']], dtype=dtype)
+        start = stop
+    frame = pd.DataFrame(np.array(data, dtype=np.float64 if dtype.kind == 'f' else dtype), columns=meta['columns'], index=meta['first_sample']+np.arange(start, stop, dtype=np.int64))
+    frame['session'] = pd.Timestamp(meta['session'])
+    frame['subj'] = np.float64(meta['subj'])
+    return frame
+
+def convert_spill(path, out_file=None, chunksize=1000000):
+    """
+    Appends a spill file's samples not yet in out_file (default: its session's file) to its table, and returns how many
+    """
+    meta,n = read_header(path)
+    out_file = out_file or meta['out_file']
+    key = meta.get('key', 'analog')
+    sesh = pd.Timestamp(meta['session'])
+    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+    n_rows = 0
+    with pd.HDFStore(out_file, mode='a') as f:
+        # an interrupted conversion leaves a prefix of the samples in the table
+        done = 0
+        if key in f and n:
+            lo,hi = meta['first_sample'],meta['first_sample']+n-1
+            done = len(f.select_as_coordinates(key, where='session == sesh & index >= lo & index <= hi'))
+        for i0 in xrange(done, n, chunksize):
+            chunk = read_spill(path, i0, i0+chunksize)
+            f.append(key, chunk, index=False, data_columns=['session','subj'], **meta.get('table_opts', {}))
+            n_rows += len(chunk)
+    return n_rows
+
+def convert_spills(spill_dir, remove=True):
+    """
+    Converts every spill file in spill_dir (none may still be written to), and returns how many
+    """
+    n = 0
+    for path in sorted(glob.glob(os.path.join(spill_dir, '*'+EXT))):
+        try:
+            out_file = read_header(path)[0]['out_file']
+            if not os.path.exists(out_file):
+                logging.warning('Store {} of spill file {} no longer exists; convert it manually with --out.'.format(out_file, path))
+                continue
+            n_rows = convert_spill(path)
+        except:
+            logging.error('Failed to convert spill file {}; it remains in place.'.format(path))
+            logging.error(sys.exc_info())
+            continue
+        logging.info('Converted spill file {}: {} samples into {}.'.format(path, n_rows, out_file))
+        n += 1
+        if remove:
+            os.remove(path)
+    return n
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert AnalogReader spill files into HDF')
+    parser.add_argument('path', help='spill file, or directory of spill files')
+    parser.add_argument('--out', default=None, help='store to convert into, instead of the one each file was written for')
+    parser.add_argument('--keep', action='store_true', help='keep spill files after converting them')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path) and args.out is None:
+        print('Converted {} spill file(s).'.format(convert_spills(args.path, remove=not args.keep)))
+    else:
+        paths = sorted(glob.glob(os.path.join(args.path, '*'+EXT))) if os.path.isdir(args.path) else [args.path]
+        for path in paths:
+            print('{}: {} samples converted.'.format(path, convert_spill(path, args.out)))
+            if not args.keep:
+                os.remove(path)
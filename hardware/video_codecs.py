@@ -0,0 +1,110 @@
+"""
+Video codecs for MovieSaver, chosen by cam_params['codec'] and recorded in each mov dataset's 'codec' attribute: 'none', 'gzip:<level>' ('gzip:1' is the default), 'lzf', 'blosc:<compressor>:<level>[:bit]' or 'zstd:<level>'.
+lzf needs the lzf package; blosc and zstd need blosc or zstandard, and hdf5plugin, which is also needed to read their movies back.
+To add a codec, subclass Codec and register it in CODECS.
+"""
+import zlib, h5py
+import numpy as np
+
+class Codec(object):
+    def __init__(self, name):
+        self.name = name
+
+    def dataset_opts(self):
+        # keyword arguments for h5py's create_dataset that declare the filter
+        return {}
+
+    def compress(self, chunk):
+        # chunk: contiguous uint8 array, of one dataset chunk; returns (bytes as the filter stores them, hdf5 filter mask: 1 if the filter was skipped)
+        return chunk.tostring(), 0
+
+class Gzip(Codec):
+    def __init__(self, name, level=1):
+        super(Gzip, self).__init__(name)
+        self.level = int(level)
+
+    def dataset_opts(self):
+        return dict(compression='gzip', compression_opts=self.level)
+
+    def compress(self, chunk):
+        # a compressobj releases the GIL while compressing
+        c = zlib.compressobj(self.level)
+        return c.compress(chunk) + c.flush(), 0
+
+class LZF(Codec):
+    def __init__(self, name):
+        super(LZF, self).__init__(name)
+        import lzf
+        self._lzf = lzf
+
+    def dataset_opts(self):
+        return dict(compression='lzf')
+
+    def compress(self, chunk):
+        # as h5py's filter: stored uncompressed when lzf cannot shrink it
+        data = self._lzf.compress(chunk.data, chunk.nbytes)
+        if data is None:
+            return chunk.tostring(), 1
+        return data, 0
+
+class Blosc(Codec):
+    FILTER = 32001
+    COMPRESSORS = dict(blosclz=0, lz4=1, lz4hc=2, snappy=3, zlib=4, zstd=5)
+
+    def __init__(self, name, cname='lz4', level=5, shuffle=''):
+        super(Blosc, self).__init__(name)
+        import blosc, hdf5plugin # hdf5plugin registers the filter with hdf5
+        self._blosc = blosc
+        if cname not in self.COMPRESSORS:
+            raise Exception('Unknown blosc compressor {}.'.format(cname))
+        self.cname = cname
+        self.level = int(level)
+        self.shuffle = blosc.BITSHUFFLE if shuffle == 'bit' else blosc.NOSHUFFLE # byte shuffling is a no-op on uint8
+
+    def dataset_opts(self):
+        # the first four filter values are filled in by the filter itself
+        return dict(compression=self.FILTER, compression_opts=(0, 0, 0, 0, self.level, self.shuffle, self.COMPRESSORS[self.cname]))
+
+    def compress(self, chunk):
+        return self._blosc.compress_ptr(chunk.__array_interface__['data'][0], chunk.size, typesize=1, clevel=self.level, shuffle=self.shuffle, cname=self.cname), 0
+
+class Zstd(Codec):
+    FILTER = 32015
+
+    def __init__(self, name, level=3):
+        super(Zstd, self).__init__(name)
+        import zstandard, hdf5plugin # hdf5plugin registers the filter with hdf5
+        self.level = int(level)
+        self._zstd = zstandard.ZstdCompressor(level=self.level, write_content_size=True) # the filter sizes its output from the frame's content size
+
+    def dataset_opts(self):
+        return dict(compression=self.FILTER, compression_opts=(self.level,))
+
+    def compress(self, chunk):
+        return self._zstd.compress(chunk), 0
+
+CODECS = {'none':Codec, 'gzip':Gzip, 'lzf':LZF, 'blosc':Blosc, 'zstd':Zstd}
+
+def make_codec(codec='gzip:1'):
+    # codec string (see above) -> Codec
+    kind = codec.split(':')
+    if kind[0] not in CODECS:
+        raise Exception('Unknown video codec {}.'.format(codec))
+    return CODECS[kind[0]](codec, *kind[1:])
+
+def read_frames(path, idx, cam=0):
+    """
+    Frames of camera cam at frame indices idx (an int, slice, or any sequence of indices, in any order) from a movie file, and their (now(),now2()) timestamps
+    """
+    try:
+        import hdf5plugin # for movies saved with blosc or zstd
+    except ImportError:
+        pass
+    with h5py.File(path, 'r') as f:
+        mov,ts = f['mov{}'.format(cam)],f['ts{}'.format(cam)]
+        if isinstance(idx, (int, np.integer, slice)):
+            return mov[idx], ts[idx]
+        # h5py reads sorted, unique indices only
+        idx = np.asarray(idx)
+        u,inv = np.unique(idx, return_inverse=True)
+        return mov[list(u)][inv], ts[list(u)][inv]
@@ -1,6 +1,8 @@
 import numpy as np
 import copy
 from expts.session import Session as S
+from expts.shards import default_shard_dir
+from expts.journal import default_journal_dir
 from hardware.cameras import default_cam_params, cam1_params
 from conditions import default_condition, conditions
 from settings.manipulations import default_manipulation
@@ -74,6 +76,18 @@ class ParamHandler(object):
         # Movie parameters
         cam_params                  = default_cam_params, #cam1_params,
 
+        # Saving parameters
+        saver_params                = dict( flush_policies = dict(  default = dict(max_age=60., on_iti=True), # sparse event sources get written in each ITI, and at least every minute
+                                                                    analog = dict(max_age=None, on_iti=False), # flushed by count only, in large chunks
+                                                                    analog_int16 = dict(max_age=None, on_iti=False),
+                                                                 ),
+                                            shard_dir = default_shard_dir(config.datafile), # each session is written to its own file, merged into datafile between sessions
+                                            journal_dir = default_journal_dir(config.datafile), # every write is journaled first, and replayed after a crash
+                                            compression = dict( analog = dict(complib='blosc:lz4', complevel=5, expectedrows=2000000), # ~5x smaller at close to uncompressed write speed (see util/bench_codecs.py)
+                                                                analog_int16 = dict(complib='blosc:lz4', complevel=5, expectedrows=2000000),
+                                                              ),
+                                          ),
+
         # Experiment parameters
         subj                        = None,
         condition                   = None,
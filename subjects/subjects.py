@@ -4,12 +4,18 @@ import os, sys, h5py, time, logging
 pjoin = os.path.join
 import config
 from hardware.valve import reward_scale_to_volume
+from expts.history import select, summary_ok, SUMMARY_KEY
 
 def list_subjects():
     #subs = [d for d in os.listdir(data_path) if os.path.isdir(pjoin(data_path,d))]
     #return subs
     if not os.path.exists(config.datafile):
         return []
+    if summary_ok(config.datafile):
+        summ = select(SUMMARY_KEY, config.datafile)
+        if summ is None:
+            return []
+        return summ.subj.unique().astype(int).astype(str)
     with pd.HDFStore(config.datafile) as f:
         if 'trials' not in f:
             return []
@@ -19,6 +25,21 @@ def list_rewards():
     today = pd.datetime.now().date()
     if not os.path.exists(config.datafile):
         return {}
+    if summary_ok(config.datafile):
+        summ = select(SUMMARY_KEY, config.datafile, where='session >= {!r}'.format(str(pd.Timestamp(today))))
+        res = {}
+        if summ is None:
+            return res
+        for subn in summ.subj.unique():
+            ssub = summ[summ.subj==subn]
+            vol = 0.
+            for si,side in enumerate(['l','r']):
+                n = ssub['n_rewards_'+side].sum()
+                if n:
+                    # volume is linear in reward scale, so n rewards of mean scale give the total
+                    vol += n * reward_scale_to_volume(si, ssub['reward_scale_'+side].sum()/float(n))
+            res[str(int(subn))] = vol
+        return res
     with pd.HDFStore(config.datafile) as f:
         if 'trials' not in f:
             return {}
@@ -0,0 +1,108 @@
+"""
+Camera saving benchmark: frames per second per camera that MovieSaver sustains at each resolution and colour mode, with producers filling the frame rings as fast as it frees them. Frames are synthetic, or tiled from a recorded movie.
+MovieSaver needs TESTING_MODE off, so run this on a rig (no cameras are needed):
+    python -m util.bench_cameras --movie data/subj/20170101120000.h5 --cams 2 --duration 20
+"""
+import os, sys, time, ctypes, tempfile, shutil, argparse, h5py
+import multiprocessing as mp
+import numpy as np
+from util import now, now2
+from hardware.cameras import MovieSaver, _PSEye
+from hardware.ring_buffer import FrameRing
+
+def frame_shape(resolution_mode, color_mode):
+    x,y = _PSEye.DIMENSIONS[resolution_mode]
+    return (y,x,_PSEye.BYTES_PER_PIXEL[color_mode]) if color_mode == _PSEye.COLOUR else (y,x)
+
+def load_frames(shape, movie=None, n=32):
+    # n frames of the given shape, as uint8
+    y,x = shape[:2]
+    if movie is not None:
+        with h5py.File(movie, 'r') as f:
+            mov = f['mov0'][:n]
+        frs = np.tile(mov, [1, -(-y//mov.shape[1]), -(-x//mov.shape[2])])[:, :y, :x]
+    else:
+        yy,xx = np.mgrid[:y,:x]
+        frs = []
+        for i in range(n):
+            cy,cx = y/2. + y/4.*np.sin(2*np.pi*i/n), x/2. + x/4.*np.cos(2*np.pi*i/n)
+            fr = 60 + 40.*xx/x + 120*np.exp(-((yy-cy)**2+(xx-cx)**2)/(2*(y/10.)**2)) + np.random.normal(0, 3, (y,x))
+            frs.append(np.clip(fr, 0, 255).astype(np.uint8))
+        frs = np.array(frs)
+    if len(shape) == 3:
+        frs = np.repeat(frs[...,None], shape[2], axis=3)
+    return np.ascontiguousarray(frs)
+
+def produce(ring, frames, stop):
+    # Fills ring with frames, cycling through them, until stop is set
+    i = 0
+    while not stop.value:
+        addr = ring.slot_address()
+        if addr is None:
+            time.sleep(0.0005)
+            continue
+        ctypes.memmove(addr, frames[i % len(frames)].ctypes.data, ring.frame_bytes)
+        ring.publish(now(), now2(), True)
+        i += 1
+
+def run_one(shape, n_cams=2, duration=10., movie=None, out_dir=None, ring_slots=256):
+    """
+    Runs a MovieSaver fed by n_cams producers of frames of the given shape for duration secs; returns one dict of results per camera
+    """
+    frames = load_frames(shape, movie)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_cameras_', dir=out_dir)
+    try:
+        rings = [FrameRing(int(np.product(shape)), n_slots=ring_slots) for _ in range(n_cams)]
+        kill_flag,flushing,stop = mp.Value('b', False),mp.Value('b', True),mp.Value('b', False)
+        saver = MovieSaver(name=os.path.join(tmp_dir, 'bench'), kill_flag=kill_flag, frame_buffer=rings, flushing=flushing, n_cams=n_cams, frame_shapes=[shape]*n_cams)
+        producers = [mp.Process(target=produce, args=(r, frames, stop)) for r in rings]
+        for p in producers:
+            p.start()
+        t0 = now2()
+        time.sleep(duration)
+        taken = [r.n_written-r.qsize() for r in rings]
+        dur = now2()-t0
+        stop.value = True
+        for p in producers:
+            p.join()
+        kill_flag.value = True
+        saver.join()
+        results = []
+        with h5py.File(saver.name, 'r') as f:
+            for i in range(n_cams):
+                mov = f['mov{}'.format(i)]
+                raw = mov.size
+                stored = mov.id.get_storage_size()
+                results.append(dict(shape=shape, n_cams=n_cams, cam=i, fps=taken[i]/dur, mbps=taken[i]*np.product(shape)/dur/1e6, ratio=float(stored)/raw if raw else np.nan, saved=len(mov), published=rings[i].n_written))
+        return results
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def run(resolution_modes=[_PSEye.RES_SMALL, _PSEye.RES_LARGE], color_modes=[_PSEye.GREYSCALE, _PSEye.COLOUR], n_cams=2, duration=10., movie=None, out_dir=None):
+    results = []
+    for rm in resolution_modes:
+        for cm in color_modes:
+            for r in run_one(frame_shape(rm, cm), n_cams=n_cams, duration=duration, movie=movie, out_dir=out_dir):
+                r.update(resolution_mode=rm, color_mode=cm, max_fps=max(_PSEye.available_framerates[rm]))
+                results.append(r)
+    return results
+
+def report(results, out=sys.stdout):
+    w = out.write
+    w('{:>12}{:>8}{:>6}{:>5}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}\n'.format('resolution','colour','cams','cam','fps','max fps','MB/s','size','saved','complete'))
+    for r in results:
+        res = '{}x{}'.format(r['shape'][1], r['shape'][0])
+        colour = 'colour' if r['color_mode'] == _PSEye.COLOUR else 'grey'
+        w('{:>12}{:>8}{:>6}{:>5}{:>10.1f}{:>10}{:>10.1f}{:>10.3f}{:>10}{:>10}\n'.format(res, colour, r['n_cams'], r['cam'], r['fps'], r['max_fps'], r['mbps'], r['ratio'], r['saved'], str(r['saved']==r['published'])))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Camera saving benchmark')
+    parser.add_argument('--movie', default=None, help='recorded movie file to take frames from (its mov0 dataset), instead of synthetic frames')
+    parser.add_argument('--cams', type=int, default=2, help='number of cameras')
+    parser.add_argument('--duration', type=float, default=10., help='secs to run for, per resolution and colour mode')
+    parser.add_argument('--dir', default=None, help='directory to write the movie files in (default: the system temp directory)')
+    parser.add_argument('--grey', action='store_true', help='greyscale only')
+    args = parser.parse_args()
+
+    color_modes = [_PSEye.GREYSCALE] if args.grey else [_PSEye.GREYSCALE, _PSEye.COLOUR]
+    report(run(color_modes=color_modes, n_cams=args.cams, duration=args.duration, movie=args.movie, out_dir=args.dir))
@@ -0,0 +1,106 @@
+"""
+HDF compression codec benchmark for Saver tables: write speed, CPU, read-back time and file size per codec, on rows of a recorded data file, or synthetic analog, analog_int16 or analogreader rows.
+    python -m util.bench_codecs --source analog_int16 --codecs none zlib:1 blosc:lz4:5
+"""
+import os, sys, time, tempfile, shutil, argparse, warnings, tables
+import numpy as np
+import pandas as pd
+from util import now2
+from expts.saver import Saver
+
+DEFAULT_CODECS = ['none', 'zlib:1', 'zlib:9', 'lzo:1', 'blosc:blosclz:5', 'blosc:lz4:5', 'blosc:lz4hc:5', 'blosc:zstd:3', 'blosc:zstd:5']
+
+def parse_codec(codec):
+    # 'none', 'zlib:9' or 'blosc:lz4:5' -> table options
+    if codec == 'none':
+        return dict(complevel=0, complib=None)
+    complib,complevel = codec.rsplit(':', 1)
+    return dict(complevel=int(complevel), complib=complib)
+
+def codec_available(complib):
+    if complib is None:
+        return True
+    if complib.startswith('blosc:'):
+        return tables.which_lib_version('blosc') is not None and complib.split(':')[1] in tables.blosc_compressor_list()
+    return tables.which_lib_version(complib) is not None
+
+def load_rows(data_file=None, source='analog', n_rows=1000000, n_channels=6):
+    """
+    n_rows rows of the source table of data_file, or synthetic rows shaped like it (analog, analog_int16 or analogreader)
+    """
+    if data_file is not None:
+        with pd.HDFStore(data_file, mode='r') as f:
+            return f.select(source, start=0, stop=n_rows)
+    if source not in ['analog', 'analog_int16', 'analogreader']:
+        raise Exception('No synthetic rows for source {}; supply a data file.'.format(source))
+    samples = np.arange(n_rows)
+    t = samples/500.
+    data = np.array([np.sin(2*np.pi*t/(10.+i)) + np.random.normal(0, .05, n_rows) for i in range(n_channels)]).T
+    data = np.round(data/(20./2**16))
+    if source == 'analog_int16':
+        data = data.astype(np.int16)
+    else:
+        data = data * (20./2**16)
+    df = pd.DataFrame(data, columns=['ch{}'.format(i) for i in range(n_channels)], index=t if source == 'analogreader' else samples)
+    df['session'] = pd.Timestamp('2000-01-01')
+    df['subj'] = 0.
+    if source == 'analogreader':
+        df['ts_global'] = 1e9 + t
+    return df
+
+def run(rows, codecs=DEFAULT_CODECS, block=8000, expectedrows=None, source='analog'):
+    """
+    Writes rows into a temporary file once per codec; returns a list of dicts of results
+    """
+    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+    raw_bytes = rows.memory_usage(index=True).sum()
+    data_columns = [c for c in ['session','subj','ts_global'] if c in rows]
+    tmp_dir = tempfile.mkdtemp(prefix='bench_codecs_')
+    results = []
+    try:
+        for codec in codecs:
+            opts = dict(Saver.DEFAULT_TABLE_OPTIONS, expectedrows=expectedrows)
+            opts.update(parse_codec(codec))
+            if not codec_available(opts['complib']):
+                print('Skipping {}: not available in this PyTables build'.format(codec))
+                continue
+            path = os.path.join(tmp_dir, 'bench.h5')
+
+            cpu0,t0 = sum(os.times()[:2]),now2()
+            with pd.HDFStore(path, mode='w') as f:
+                for i0 in range(0, len(rows), block):
+                    f.append(source, rows.iloc[i0:i0+block], index=False, data_columns=data_columns, **opts)
+                chunkshape = f.get_storer(source).table.chunkshape
+            t_write,cpu_write = now2()-t0,sum(os.times()[:2])-cpu0
+            file_size = os.path.getsize(path)
+
+            t0 = now2()
+            with pd.HDFStore(path, mode='r') as f:
+                f.select(source)
+            t_read = now2()-t0
+
+            os.remove(path)
+            results.append(dict(codec=codec, t_write=t_write, cpu_write=cpu_write, t_read=t_read, file_size=file_size, raw_bytes=raw_bytes, chunkshape=chunkshape))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+def report(results, n_rows, out=sys.stdout):
+    w = out.write
+    w('{} rows, {:0.1f} MB in memory\n\n'.format(n_rows, results[0]['raw_bytes']/1e6 if results else np.nan))
+    w('{:<18}{:>12}{:>12}{:>12}{:>12}{:>10}{:>12}\n'.format('codec','write MB/s','cpu (s)','read (s)','file (MB)','ratio','chunkshape'))
+    for r in results:
+        w('{:<18}{:>12.1f}{:>12.2f}{:>12.2f}{:>12.1f}{:>10.2f}{:>12}\n'.format(r['codec'], r['raw_bytes']/1e6/r['t_write'], r['cpu_write'], r['t_read'], r['file_size']/1e6, float(r['raw_bytes'])/r['file_size'], r['chunkshape'][0]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HDF compression codec benchmark for Saver tables')
+    parser.add_argument('data_file', nargs='?', default=None, help='recorded data file to take rows from (synthetic analog data if omitted)')
+    parser.add_argument('--source', default='analog', help='table to benchmark; without a data file, analog, analog_int16 or analogreader')
+    parser.add_argument('--rows', type=int, default=1000000, help='number of rows to write')
+    parser.add_argument('--block', type=int, default=8000, help='rows per append')
+    parser.add_argument('--expectedrows', type=int, default=None, help='expected table size in rows, from which the chunkshape is derived')
+    parser.add_argument('--codecs', nargs='+', default=DEFAULT_CODECS, help='codecs as complib:complevel, or none')
+    args = parser.parse_args()
+
+    rows = load_rows(args.data_file, args.source, args.rows)
+    report(run(rows, args.codecs, args.block, args.expectedrows, args.source), len(rows))
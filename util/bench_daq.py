@@ -0,0 +1,78 @@
+"""
+DAQ read block size benchmark, on the dummy DAQIn: for each sample rate and read_buf_size, the callback's cost per read through the ReadRing (and through the old queue), reads delivered and dropped, and latency to the AnalogReader.
+A real DAQ adds read_buf_size/daq_sample_rate secs of buffering to that latency.
+    python -m util.bench_daq --rates 5000 --blocks 10 50 100 250 --duration 10
+"""
+import sys, argparse, Queue
+import multiprocessing as mp
+import numpy as np
+from util import now, now2
+from hardware.dummy import DAQIn
+from hardware.ring_buffer import ReadRing
+
+def callback_overhead(n_ports, block, n=2000):
+    # Secs per read to hand it over (queue, ring), draining afterwards
+    read_data = np.random.normal(0, 1, n_ports*block)
+    q = mp.Queue()
+    t0 = now2()
+    for _ in xrange(n):
+        q.put([now(), now2(), read_data.copy()])
+    dur_q = now2()-t0
+    for _ in xrange(n):
+        q.get()
+
+    ring = ReadRing(n_ports*block, n_slots=n)
+    t0 = now2()
+    for _ in xrange(n):
+        ring.slot()[:] = read_data
+        ring.publish(now(), now2())
+    dur_r = now2()-t0
+    return dur_q/n, dur_r/n
+
+def end_to_end(n_ports, block, rate, duration):
+    # Runs a dummy DAQIn for duration secs; returns (reads received, reads dropped, latencies)
+    ports = ['ai{}'.format(i) for i in range(n_ports)]
+    daq = DAQIn(ports=ports, read_buffer_size=block, sample_rate=rate)
+    lat = []
+    t0 = now2()
+    while now2()-t0 < duration:
+        try:
+            seq,ts,ts2,dat = daq.ring.get(timeout=0.5)
+        except Queue.Empty:
+            continue
+        dat = dat.reshape((n_ports,block))
+        lat.append(now2()-ts2)
+        daq.ring.release()
+    daq.release()
+    return len(lat), daq.ring.n_dropped, np.array(lat)
+
+def run(rates=[500., 2000., 5000., 10000.], blocks=[1, 10, 50, 100, 500], n_ports=6, duration=5.):
+    """
+    Returns a list of dicts of results, one per rate and block size (see report)
+    """
+    results = []
+    for rate in rates:
+        for block in blocks:
+            per_read_q,per_read = callback_overhead(n_ports, block)
+            n,dropped,lat = end_to_end(n_ports, block, rate, duration)
+            results.append(dict(rate=rate, block=block, per_read_q=per_read_q, per_read=per_read, core=per_read*rate/block,
+                                reads=n/duration, expected=rate/block, dropped=dropped, latency=lat))
+    return results
+
+def report(results, out=sys.stdout):
+    w = out.write
+    w('{:>10}{:>8}{:>14}{:>14}{:>10}{:>12}{:>12}{:>10}{:>12}{:>12}{:>12}\n'.format('rate (Hz)','block','queue us/read','ring us/read','% core','reads/s','expected','dropped','p50 (ms)','p99 (ms)','max (ms)'))
+    for r in results:
+        lat = r['latency'] if len(r['latency']) else np.array([np.nan])
+        p50,p99 = np.percentile(lat, [50,99])
+        w('{:>10.0f}{:>8}{:>14.1f}{:>14.1f}{:>10.2f}{:>12.1f}{:>12.1f}{:>10}{:>12.3f}{:>12.3f}{:>12.3f}\n'.format(r['rate'], r['block'], r['per_read_q']*1e6, r['per_read']*1e6, r['core']*100, r['reads'], r['expected'], r['dropped'], p50*1e3, p99*1e3, np.max(lat)*1e3))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DAQ read block size benchmark')
+    parser.add_argument('--rates', type=float, nargs='+', default=[500., 2000., 5000., 10000.], help='sample rates (Hz)')
+    parser.add_argument('--blocks', type=int, nargs='+', default=[1, 10, 50, 100, 500], help='samples per read')
+    parser.add_argument('--ports', type=int, default=6, help='number of analog channels')
+    parser.add_argument('--duration', type=float, default=5., help='secs to run the dummy DAQ for, per rate and block size')
+    args = parser.parse_args()
+
+    report(run(args.rates, args.blocks, args.ports, args.duration))
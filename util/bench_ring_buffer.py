@@ -0,0 +1,90 @@
+"""
+AnalogReader buffer benchmark: CPU per read of AnalogReader.run's buffer work with the old np.roll buffers versus RingBuffer, at each sample rate.
+Buffers hold as many secs at every rate as the defaults do at 500 Hz, unless --fixed-buffers.
+    python -m util.bench_ring_buffer --rates 500 5000 20000 --reads 20000
+"""
+import sys, time, argparse
+import numpy as np
+from hardware.ring_buffer import RingBuffer, SeqlockRing
+
+READ_BUF_SIZE = 10
+BASE_RATE = 500.
+BASE_SAVE_BUFFER_SIZE = 8000
+BASE_ACCUM_SIZE = 2000
+
+def sizes(rate, fixed_buffers=False):
+    # (save buffer size, accumulator size, holding window, moving window) in samples, for AnalogReader defaults at this rate
+    scale = 1. if fixed_buffers else rate/BASE_RATE
+    round_to_read = lambda n: int(READ_BUF_SIZE*np.ceil(n/READ_BUF_SIZE))
+    return round_to_read(BASE_SAVE_BUFFER_SIZE*scale), round_to_read(BASE_ACCUM_SIZE*scale), int(1.*rate), int(1.*rate)
+
+def bench_roll(reads, n_ports, runtime_ports, lickport_idxs, moving_idx, save_size, accum_size, holding, moving):
+    save_buffer = np.zeros([n_ports, save_size])
+    save_buffer_ts = np.zeros([2, save_size])
+    accum = np.zeros([n_ports, accum_size])
+    accum_pub = np.zeros([len(runtime_ports), accum_size])
+    t0 = time.time()
+    for ts,dat in reads:
+        save_buffer = np.roll(save_buffer, -READ_BUF_SIZE, axis=1)
+        save_buffer_ts = np.roll(save_buffer_ts, -READ_BUF_SIZE, axis=1)
+        save_buffer[:,-READ_BUF_SIZE:] = dat
+        save_buffer_ts[:,-READ_BUF_SIZE:] = np.array([ts,ts])[:,None]
+        accum = np.roll(accum, -READ_BUF_SIZE, axis=1)
+        accum[:,-READ_BUF_SIZE:] = dat
+        accum_pub[:] = accum.copy()[runtime_ports]
+        np.any(np.all(accum[lickport_idxs,-holding:]>6., axis=1))
+        _tmp_moving = accum[moving_idx,-moving:]
+        np.max(_tmp_moving)-np.min(_tmp_moving) > 5.
+    return time.time()-t0
+
+def bench_ring(reads, n_ports, runtime_ports, lickport_idxs, moving_idx, save_size, accum_size, holding, moving):
+    save_buffer = RingBuffer(n_ports, max(save_size, accum_size))
+    save_buffer_ts = RingBuffer(2, max(save_size, accum_size))
+    read_ts = np.zeros([2, READ_BUF_SIZE])
+    window = SeqlockRing(len(runtime_ports)+1, accum_size)
+    window_block = np.zeros([len(runtime_ports)+1, READ_BUF_SIZE])
+    t0 = time.time()
+    for ts,dat in reads:
+        save_buffer.write(dat)
+        read_ts[0] = ts
+        read_ts[1] = ts
+        save_buffer_ts.write(read_ts)
+        window_block[:-1] = dat[runtime_ports]
+        window_block[-1] = ts
+        window.write(window_block)
+        np.any(np.all(save_buffer.last(holding)[lickport_idxs]>6., axis=1))
+        _tmp_moving = save_buffer.last(moving)[moving_idx]
+        np.max(_tmp_moving)-np.min(_tmp_moving) > 5.
+    return time.time()-t0
+
+def run(rates=[500., 5000., 20000.], n_reads=10000, n_ports=6, runtime_ports=[0,1,5], fixed_buffers=False):
+    """
+    Returns a list of dicts of results, one per rate and scheme (see report)
+    """
+    lickport_idxs = np.asarray(runtime_ports)[[0,1]]
+    moving_idx = runtime_ports[2]
+    reads = [(float(i), np.random.normal(0, 1, size=[n_ports, READ_BUF_SIZE])) for i in range(n_reads)]
+    results = []
+    for rate in rates:
+        save_size,accum_size,holding,moving = sizes(rate, fixed_buffers)
+        for scheme,fxn in [('roll',bench_roll), ('ring',bench_ring)]:
+            dur = fxn(reads, n_ports, runtime_ports, lickport_idxs, moving_idx, save_size, accum_size, holding, moving)
+            per_read = dur/n_reads
+            results.append(dict(rate=rate, scheme=scheme, save_size=save_size, accum_size=accum_size, per_read=per_read, core=per_read*rate/READ_BUF_SIZE))
+    return results
+
+def report(results, out=sys.stdout):
+    w = out.write
+    w('{:>10}{:>8}{:>12}{:>12}{:>14}{:>12}\n'.format('rate (Hz)','scheme','save buf','accum','us / read','% core'))
+    for r in results:
+        w('{:>10.0f}{:>8}{:>12}{:>12}{:>14.1f}{:>12.1f}\n'.format(r['rate'], r['scheme'], r['save_size'], r['accum_size'], r['per_read']*1e6, r['core']*100))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AnalogReader buffer benchmark')
+    parser.add_argument('--rates', type=float, nargs='+', default=[500., 5000., 20000.], help='sample rates (Hz)')
+    parser.add_argument('--reads', type=int, default=10000, help='reads to replay per rate and scheme')
+    parser.add_argument('--ports', type=int, default=6, help='number of analog channels')
+    parser.add_argument('--fixed-buffers', action='store_true', help='keep AnalogReader\'s default buffer sizes in samples at every rate')
+    args = parser.parse_args()
+
+    report(run(args.rates, args.reads, args.ports, fixed_buffers=args.fixed_buffers))
@@ -0,0 +1,212 @@
+"""
+Saver throughput and latency benchmark: replays synthetic session records (analog dumps as AnalogReader._dump sends them, events, trials, ...) into a Saver writing a temporary file, and reports records/s, enqueue-to-disk latency, rows lost, queue depth and peak RSS (with psutil).
+Latency of sample-indexed tables (analog, analog_int16) runs from the saver's receipt of the batch; that of analog_blocks covers the dumps' whole path.
+    python -m util.bench_saver --duration 120 --ar-rate 5000 --ring --int16
+"""
+import os, sys, time, json, tempfile, shutil, argparse, threading, Queue
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from util import now, now2
+from expts.saver import Saver
+from expts.routines import add_to_saver_buffer
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PORTNAMES = ['lickl','lickr','puffl','puffr','galvo','hall']
+
+class _Subject(object):
+    # Stand-in for subjects.Subject
+    num = 0
+    name = '0'
+
+class _Session(object):
+    # Stand-in for the parts of expts.session.Session that the Saver uses
+    def __init__(self):
+        self.params = dict(benchmark=True)
+        self.sync_to_save = mp.Queue()
+    def get_code(self):
+        return json.dumps({})
+
+def make_streams(ar_rate=500., ar_block=8000, n_channels=len(PORTNAMES), scale=1., int16=False):
+    """
+    Streams of records, as dicts of source, interval (secs between records) and make (returns a record's data), at rates of a typical session times scale
+    """
+    if int16:
+        analog = dict(source='analog_int16', interval=ar_block/ar_rate, make=lambda: np.random.randint(-2**15, 2**15, size=[n_channels, ar_block]).astype(np.int16))
+    else:
+        analog = dict(source='analog', interval=ar_block/ar_rate, make=lambda: np.random.normal(0, 1, size=[n_channels, ar_block]))
+    trial_i = [0]
+    def trials_timing():
+        trial_i[0] += 1
+        n = np.random.poisson(25)
+        return pd.DataFrame(dict(side=np.random.randint(0,2,n), time=np.sort(np.random.uniform(0,3.8,n)), trial=trial_i[0]))
+    def trial():
+        return dict(idx=float(trial_i[0]), start=now(), end=now(), dur=3.8, ratio=2., nL=10., nR=15., nL_intended=10., nR_intended=15., side=1., condition=0., manipulation=0., outcome=1., reward=now(), delay=1., rule=0., level=5., reward_scale=1., draw_p=.5)
+    streams = [
+        analog,
+        dict(source='stimulator', interval=1./(5.*scale), make=lambda: dict(side=np.random.randint(0,2), state=np.random.randint(0,2))),
+        dict(source='spout', interval=1./(.2*scale), make=lambda: dict(side=np.random.randint(0,2), state=np.random.randint(0,2))),
+        dict(source='phases', interval=1./(.6*scale), make=lambda: dict(trial=trial_i[0], phase=np.random.randint(0,7), start_time=now(), end_time=now())),
+        dict(source='trials', interval=1./(.1*scale), make=trial),
+        dict(source='trials_timing', interval=1./(.1*scale), make=trials_timing),
+        dict(source='light', interval=1./(.2*scale), make=lambda: dict(state=np.random.randint(0,2))),
+        dict(source='speaker', interval=1./(.3*scale), make=lambda: dict(filename=np.random.randint(0,5))),
+    ]
+    return streams
+
+def run(duration=30., streams=None, ring=False, ar_block=8000, read_buf_size=10, int16=False, sample_interval=0.25, saver_kwargs={}):
+    """
+    Replays streams into a fresh Saver for duration secs and waits for its final flush; returns a dict of results
+    """
+    if streams is None:
+        streams = make_streams(ar_block=ar_block, int16=int16)
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_saver_')
+    data_file = os.path.join(tmp_dir, 'data.h5')
+
+    sync_flag = mp.Value('b', False)
+    sesh = _Session()
+    write_log = mp.Queue()
+    ring_shape = (len(PORTNAMES), ar_block) if ring else None
+    opts = dict(ring_dtype=np.int16 if int16 else np.float64)
+    opts.update(saver_kwargs)
+    saver = Saver(_Subject(), pd.datetime.now(), sesh, data_file=data_file, sync_flag=sync_flag, ring_shape=ring_shape, write_log=write_log, **opts)
+    sync_flag.value = True
+    sesh.sync_to_save.put(dict(saver=saver.sync_val.value, session=now()))
+
+    # collect write notifications as they come, so the saver is never blocked on a full pipe
+    written = {}
+    latencies = {}
+    def collect():
+        while True:
+            item = write_log.get()
+            if item is None:
+                break
+            source,n,t_enqueued,t_written = item
+            written[source] = written.get(source, 0) + n
+            latencies.setdefault(source, []).append(t_written-np.broadcast_to(t_enqueued, n))
+    collector = threading.Thread(target=collect)
+    collector.start()
+
+    # sample queue depth and saver memory
+    trace = []
+    sampling = [True]
+    proc = psutil.Process(saver.pid) if psutil is not None else None
+    def sample():
+        while sampling[0]:
+            try:
+                depth = saver.buf.qsize()
+            except NotImplementedError:
+                depth = -1
+            rss = np.nan
+            if proc is not None:
+                try:
+                    rss = proc.memory_info().rss
+                except psutil.Error:
+                    pass
+            trace.append((now2(), depth, rss))
+            time.sleep(sample_interval)
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+
+    # replay
+    sent = {}
+    n_records = 0
+    n_fallback = 0
+    n_samples = 0
+    t0 = now2()
+    due = [t0+st['interval'] for st in streams]
+    while True:
+        i = int(np.argmin(due))
+        if due[i] > t0+duration:
+            break
+        wait = due[i]-now2()
+        if wait > 0:
+            time.sleep(wait)
+        st = streams[i]
+        data = st['make']()
+        source = st['source']
+        if isinstance(data, np.ndarray):
+            # as AnalogReader._dump: the stamps of the dump's reads, then its samples, indexed by sample
+            n = data.shape[1]
+            n_reads = n//read_buf_size
+            samples = np.arange(n_samples, n_samples+n)
+            n_samples += n
+            stamps = samples[read_buf_size-1::read_buf_size]
+            add_to_saver_buffer(saver.buf, 'analog_blocks', stamps.astype(np.int64)[:,None], ts=np.full(n_reads, now()), ts2=np.full(n_reads, now2()), columns=['sample'])
+            sent['analog_blocks'] = sent.get('analog_blocks', 0) + n_reads
+            slot = saver.ring.put(data, samples, None) if ring else None
+            if slot is not None:
+                add_to_saver_buffer(saver.buf, source, slot, columns=PORTNAMES)
+            else:
+                n_fallback += int(ring)
+                add_to_saver_buffer(saver.buf, source, data.T.copy(), columns=PORTNAMES, samples=samples)
+        else:
+            n = len(data) if isinstance(data, pd.DataFrame) else 1
+            saver.write(source, data)
+        sent[source] = sent.get(source, 0) + n
+        n_records += 1
+        due[i] += st['interval']
+    t_end = now2()
+
+    saver.end()
+    saver.join()
+    t_done = now2()
+    write_log.put(None)
+    collector.join()
+    sampling[0] = False
+    sampler.join()
+
+    file_size = os.path.getsize(data_file)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    trace = np.array(trace)
+    trace[:,0] -= t0
+    return dict(duration=t_end-t0, final_flush=t_done-t_end, n_records=n_records, sent=sent, written=written,
+                latencies={k:np.concatenate(v) for k,v in latencies.items()}, trace=trace, file_size=file_size,
+                n_backpressure=saver.n_backpressure.value, n_fallback=n_fallback)
+
+def report(res, out=sys.stdout):
+    w = out.write
+    w('Replayed {} records over {:0.1f} s: {:0.1f} records/s\n'.format(res['n_records'], res['duration'], res['n_records']/res['duration']))
+    w('Final flush took {:0.2f} s; file size {:0.1f} MB; writer backpressure events: {}; ring fallbacks: {}\n'.format(res['final_flush'], res['file_size']/1e6, res['n_backpressure'], res['n_fallback']))
+    w('\n{:<16}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}\n'.format('source','sent','written','p50 (s)','p90 (s)','p99 (s)','max (s)'))
+    for source in sorted(res['sent']):
+        lat = res['latencies'].get(source, np.array([np.nan]))
+        p50,p90,p99 = np.percentile(lat, [50,90,99])
+        w('{:<16}{:>10}{:>10}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}\n'.format(source, res['sent'][source], res['written'].get(source,0), p50, p90, p99, np.max(lat)))
+    lost = {k:res['sent'][k]-res['written'].get(k,0) for k in res['sent'] if res['sent'][k]!=res['written'].get(k,0)}
+    w('\nRows lost: {}\n'.format(lost if lost else 'none'))
+
+    trace = res['trace']
+    depth = trace[:,1]
+    w('Queue depth: mean {:0.1f}, max {:0.0f}\n'.format(np.mean(depth), np.max(depth)))
+    if np.any(np.isfinite(trace[:,2])):
+        w('Peak saver RSS: {:0.1f} MB\n'.format(np.nanmax(trace[:,2])/1e6))
+    else:
+        w('Peak saver RSS: n/a (psutil not installed)\n')
+    w('Queue depth over time (s : depth):\n')
+    step = max(1, len(trace)//20)
+    for t,d,_ in trace[::step]:
+        w('  {:8.1f} : {:0.0f}\n'.format(t, d))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Saver throughput and latency benchmark')
+    parser.add_argument('--duration', type=float, default=30., help='secs of records to replay')
+    parser.add_argument('--scale', type=float, default=1., help='multiplier on all event rates')
+    parser.add_argument('--ar-rate', type=float, default=500., help='analog samples per second')
+    parser.add_argument('--ar-block', type=int, default=8000, help='analog samples per dump')
+    parser.add_argument('--ar-read', type=int, default=10, help='analog samples per read (analog_blocks row)')
+    parser.add_argument('--ring', action='store_true', help='send analog dumps through the shared ring')
+    parser.add_argument('--int16', action='store_true', help='send analog dumps as int16 counts, to analog_int16')
+    parser.add_argument('--trace', default=None, help='csv path to save the (time, queue depth, rss) trace to')
+    args = parser.parse_args()
+
+    streams = make_streams(ar_rate=args.ar_rate, ar_block=args.ar_block, scale=args.scale, int16=args.int16)
+    res = run(duration=args.duration, streams=streams, ring=args.ring, ar_block=args.ar_block, read_buf_size=args.ar_read, int16=args.int16)
+    report(res)
+    if args.trace:
+        pd.DataFrame(res['trace'], columns=['time','depth','rss']).to_csv(args.trace, index=False)
@@ -0,0 +1,94 @@
+"""
+Video codec benchmark on a recorded movie: each camera's frames are compressed with each codec as a MovieSaver writer does, reporting compression speed and CPU, size relative to raw, read-back speed, and whether frames read back exactly. Codecs whose packages are missing are skipped.
+    python -m util.bench_video data/subj/20170101120000.h5 --codecs none gzip:1 blosc:zstd:5:bit zstd:3
+"""
+import os, sys, tempfile, shutil, argparse, logging, h5py
+import numpy as np
+from util import now2
+from hardware.video_codecs import make_codec, read_frames
+
+DEFAULT_CODECS = ['none', 'gzip:1', 'gzip:4', 'lzf', 'blosc:lz4:5', 'blosc:lz4hc:5', 'blosc:zstd:3', 'blosc:zstd:5:bit', 'zstd:3', 'zstd:9']
+
+def load_movies(path, n_frames=3000):
+    # [(dataset name, frames)] for every mov dataset of a movie file, the first n_frames frames of each
+    with h5py.File(path, 'r') as f:
+        names = sorted(k for k in f if k.startswith('mov'))
+    return [(name, read_frames(path, slice(0, n_frames), cam=int(name[3:]))[0]) for name in names]
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+def run_one(frames, codec, path, chunk_frames=14, n_access=200):
+    # Saves frames to a new file at path with codec, and reads them back; returns a dict of results (see report)
+    n,fs = len(frames),frames.shape[1:]
+    c = make_codec(codec)
+    chunk = np.zeros((chunk_frames,)+fs, dtype=np.uint8)
+    dur_comp = cpu_comp = 0.
+    t0 = now2()
+    with h5py.File(path, 'w') as f:
+        mov = f.create_dataset('mov0', frames.shape, dtype='uint8', chunks=(chunk_frames,)+fs, **c.dataset_opts())
+        f.create_dataset('ts0', (n,2), dtype=np.float64, data=np.zeros((n,2)))
+        for i0 in xrange(0, n, chunk_frames):
+            k = min(chunk_frames, n-i0)
+            chunk[:k] = frames[i0:i0+k]
+            chunk[k:] = 0
+            t,tc = now2(),cpu_time()
+            data,mask = c.compress(chunk)
+            dur_comp += now2()-t
+            cpu_comp += cpu_time()-tc
+            mov.id.write_direct_chunk((i0,)+(0,)*len(fs), data, mask)
+    dur_write = now2()-t0
+
+    t0 = now2()
+    back,_ = read_frames(path, slice(None))
+    dur_read = now2()-t0
+    exact = (back == frames).all()
+    idx = np.random.randint(0, n, n_access)
+    with h5py.File(path, 'r') as f: # read_frames has registered any filter plugin
+        mov = f['mov0']
+        t0 = now2()
+        for i in idx:
+            exact = exact and (mov[int(i)] == frames[i]).all()
+        dur_access = now2()-t0
+
+    return dict(codec=codec, frames=n, shape=fs, mbps=frames.nbytes/dur_comp/1e6, fps=n/dur_comp, cpu=cpu_comp, write_fps=n/dur_write,
+                ratio=float(os.path.getsize(path))/frames.nbytes, read_fps=n/dur_read, access_ms=dur_access/n_access*1e3, exact=exact)
+
+def run(movie, codecs=DEFAULT_CODECS, n_frames=3000, chunk_frames=14, n_access=200):
+    """
+    Returns a list of dicts of results, one per dataset of movie and codec (see report)
+    """
+    movies = load_movies(movie, n_frames)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_video_')
+    results = []
+    try:
+        for codec in codecs:
+            try:
+                make_codec(codec)
+            except ImportError:
+                logging.warning('Skipping codec {}: {}'.format(codec, sys.exc_info()[1]))
+                continue
+            for name,frames in movies:
+                r = run_one(frames, codec, os.path.join(tmp_dir, '{}_{}.h5'.format(name, codec.replace(':','_'))), chunk_frames=chunk_frames, n_access=n_access)
+                r.update(movie=name)
+                results.append(r)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+def report(results, out=sys.stdout):
+    w = out.write
+    w('{:>6}{:>18}{:>8}{:>10}{:>10}{:>10}{:>12}{:>8}{:>10}{:>12}{:>8}\n'.format('movie','codec','frames','MB/s','fps','cpu (s)','write fps','size','read fps','access (ms)','exact'))
+    for r in results:
+        w('{:>6}{:>18}{:>8}{:>10.1f}{:>10.1f}{:>10.2f}{:>12.1f}{:>8.3f}{:>10.1f}{:>12.2f}{:>8}\n'.format(r['movie'], r['codec'], r['frames'], r['mbps'], r['fps'], r['cpu'], r['write_fps'], r['ratio'], r['read_fps'], r['access_ms'], str(r['exact'])))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Video codec benchmark')
+    parser.add_argument('movie', help='recorded movie file, with mov0 (and mov1, ...) datasets')
+    parser.add_argument('--codecs', nargs='+', default=DEFAULT_CODECS, help='codecs, as in cam_params (see hardware/video_codecs.py)')
+    parser.add_argument('--frames', type=int, default=3000, help='frames to use from each camera')
+    parser.add_argument('--chunk', type=int, default=14, help='frames per chunk')
+    args = parser.parse_args()
+
+    report(run(args.movie, args.codecs, args.frames, args.chunk))
@@ -1,10 +1,11 @@
 """
-This is a completely automated way of fixing corrupt data files, when analogreader is the culprit.
+This is a completely automated way of fixing corrupt data files, when the analog tables are the culprit.
+The analog tables are those in AR_TABLES that the data file has: analogreader (older sessions), and analog or analog_int16 with their analog_blocks.
 
 There are 2 steps, run 1 first then 2 second.
 
-Step 1 will  copy the analogreader dataset to a temp file, automatically determining points of corruption and exlcuding them.
-Step 2 will create a new data file, by merging analogreader from the temp file with all other datasets from the original data file. 
+Step 1 will  copy each analog table to a temp file (as temp_<table>), automatically determining points of corruption and exlcuding them.
+Step 2 will create a new data file, by merging the analog tables from the temp file with all other datasets from the original data file. 
 
 This script does not remove either the temp file (located in .) or the old data file.
 """
@@ -17,74 +18,84 @@ temp = './temp.h5'
 datanew = r'C:\\Users\\Wang_Lab\\Desktop\\puffs\\data\\data_new.h5'
 out = pd.HDFStore(temp)
 hdf = pd.HDFStore(data_path)
-nexisting = hdf.get_storer('analogreader').nrows
 chunk_size = 5e5
 
+# analog tables, and the data columns each is saved with: sample-indexed tables have no ts_global
+AR_TABLES = ['analogreader','analog','analog_int16','analog_blocks']
+DATA_COLUMNS = dict(analogreader=['session','subj','ts_global'], analog=['session','subj'], analog_int16=['session','subj'], analog_blocks=['session','subj','ts_global'])
+tabs = [k for k in AR_TABLES if '/'+k in hdf.keys()]
+nexisting = {k:hdf.get_storer(k).nrows for k in tabs}
+
 STEP = 2 # 1=copy out and fix corruption, 2=copy back in
 
 if STEP == 1:
 
-    for i in np.arange(np.ceil(float(nexisting)/chunk_size)):
-        i0i = int(i*chunk_size)
-        i1i = int(min(i*chunk_size+chunk_size, nexisting))
-        print '{} : {}  /  {}   (*1000)'.format(i0i/1000,i1i/1000,nexisting/1000)
+    for key in tabs:
+        print key
+        tmp_key = 'temp_'+key
+        data_columns = DATA_COLUMNS[key]
+        for i in np.arange(np.ceil(float(nexisting[key])/chunk_size)):
+            i0i = int(i*chunk_size)
+            i1i = int(min(i*chunk_size+chunk_size, nexisting[key]))
+            print '{} : {}  /  {}   (*1000)'.format(i0i/1000,i1i/1000,nexisting[key]/1000)
         
-        okay = False
-        corrupt = False
-        decorrupt = None
-        i0,i1 = i0i,i1i
+            okay = False
+            corrupt = False
+            decorrupt = None
+            i0,i1 = i0i,i1i
 
-        while okay is False:
-            try:
-                chunk = hdf.select('analogreader', start=int(i0), stop=int(i1))
+            while okay is False:
+                try:
+                    chunk = hdf.select(key, start=int(i0), stop=int(i1))
             
-                if corrupt is False:
-                    out.append('artemp', chunk, index=False, data_columns=['session','subj','ts_global'], complevel=0)
-                    okay = True
-                elif corrupt:
-                    if step == 1:
+                    if corrupt is False:
+                        out.append(tmp_key, chunk, index=False, data_columns=data_columns, complevel=0)
+                        okay = True
+                    elif corrupt:
+                        if step == 1:
+                            if decorrupt == 'bottom':
+                                out.append(tmp_key, chunk, index=False, data_columns=data_columns, complevel=0)
+                                print 'Added subchunk {} - {}'.format(i0,i1)
+                                i0 = i1
+                                i1 = i1i
+                                decorrupt = 'top'
+                                step = chunk_size//2
+                            elif decorrupt == 'top':
+                                out.append(tmp_key, chunk, index=False, data_columns=data_columns, complevel=0)
+                                print 'Added subchunk {} - {}'.format(i0,i1)
+                                okay = True
                         if decorrupt == 'bottom':
-                            out.append('artemp', chunk, index=False, data_columns=['session','subj','ts_global'], complevel=0)
-                            print 'Added subchunk {} - {}'.format(i0,i1)
-                            i0 = i1
-                            i1 = i1i
-                            decorrupt = 'top'
-                            step = chunk_size//2
+                            i1 += step
+                            step = step//2
                         elif decorrupt == 'top':
-                            out.append('artemp', chunk, index=False, data_columns=['session','subj','ts_global'], complevel=0)
-                            print 'Added subchunk {} - {}'.format(i0,i1)
-                            okay = True
+                            i0 -= step
+                            step = step//2
+
+                except tables.HDF5ExtError:
+                    if corrupt is False:
+                        print 'Corruption found in chunk {} - {}'.format(i0,i1)
+                        corrupt = True
+                        decorrupt = 'bottom'
+                        step = chunk_size//2
                     if decorrupt == 'bottom':
-                        i1 += step
-                        step = step//2
+                        i1 -= step
                     elif decorrupt == 'top':
-                        i0 -= step
-                        step = step//2
-
-            except tables.HDF5ExtError:
-                if corrupt is False:
-                    print 'Corruption found in chunk {} - {}'.format(i0,i1)
-                    corrupt = True
-                    decorrupt = 'bottom'
-                    step = chunk_size//2
-                if decorrupt == 'bottom':
-                    i1 -= step
-                elif decorrupt == 'top':
-                    i0 += step
+                        i0 += step
 
     print 'Confirm that this worked, then run STEP2'
 
     
 elif STEP == 2:
-    ncopied = out.get_storer('artemp').nrows
-    print 'table size original: {}\ntable size copied: {}\ndiff = {}'.format(nexisting,ncopied,nexisting-ncopied)
+    ncopied = {k:out.get_storer('temp_'+k).nrows for k in tabs}
+    for k in tabs:
+        print '{}\ntable size original: {}\ntable size copied: {}\ndiff = {}'.format(k,nexisting[k],ncopied[k],nexisting[k]-ncopied[k])
     go = raw_input( 'You are on step 2, which will copy all datasets to a new file. Confirm action (y/n): ')
     if go == 'y':
         dnew = pd.HDFStore(datanew)
         
         # copy all keys except AR
         for k in hdf.keys():
-            if 'analogreader' in k:
+            if k.strip('/') in AR_TABLES:
                 continue
             print k
             if 'sessions' in k:
@@ -94,12 +105,14 @@ elif STEP == 2:
                 t = hdf[k]
                 dnew.append(k, t, index=False, data_columns=['session','subj','ts_global'], complevel=0)
         # copy decorrupted AR
-        for i in np.arange(np.ceil(float(ncopied)/chunk_size)):
-            i0i = int(i*chunk_size)
-            i1i = int(min(i*chunk_size+chunk_size, ncopied))
-            print '{} : {}  /  {}   (*1000)'.format(i0i/1000,i1i/1000,ncopied/1000)
-            chunk = out.select('artemp', start=int(i0i), stop=int(i1i))
-            dnew.append('analogreader', chunk, index=False, data_columns=['session','subj','ts_global'], complevel=0)
+        for k in tabs:
+            print k
+            for i in np.arange(np.ceil(float(ncopied[k])/chunk_size)):
+                i0i = int(i*chunk_size)
+                i1i = int(min(i*chunk_size+chunk_size, ncopied[k]))
+                print '{} : {}  /  {}   (*1000)'.format(i0i/1000,i1i/1000,ncopied[k]/1000)
+                chunk = out.select('temp_'+k, start=int(i0i), stop=int(i1i))
+                dnew.append(k, chunk, index=False, data_columns=DATA_COLUMNS[k], complevel=0)
         dnew.close()  
 out.close()   
 hdf.close()
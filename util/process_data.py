@@ -21,8 +21,11 @@ if ret or not os.path.exists(comp_data):
 # Index data
 print ('Indexing...')
 d = pd.HDFStore(comp_data)
-for tab in ['analogreader','light','phases','speaker','spout','stimulator','trials','trials_timing']:
-    d.create_table_index(tab,columns=['session','subj','ts_global'], optlevel=9, kind='full')
+for tab in ['analogreader','analog','analog_int16','analog_blocks','light','phases','speaker','spout','stimulator','trials','trials_timing']:
+    if tab not in d:
+        continue
+    cols = [c for c in ['session','subj','ts_global'] if c in d.get_storer(tab).data_columns] # analog is indexed by sample, without ts_global
+    d.create_table_index(tab,columns=cols, optlevel=9, kind='full')
 d.close()
 
 if os.path.exists(trunc_file):